@@ -1,68 +1,271 @@
-import deepl
-import langdetect
-import threading
+import asyncio
+import time
 import os
 
-from discord.ext import commands
+from collections import OrderedDict
+from discord.ext import commands, tasks
 from discord import app_commands, Interaction, Message, Embed, Color, File
 from discord.app_commands import Choice
+from modules.translator import TranslationService
+from modules.translate_cache import TranslationCache
+from modules.detect import detect_language
+from modules.textfilter import mask_text
+from modules.ratelimit import QuotaLimiter, QuotaExceeded
+from modules.log import get_logger
+
+logger = get_logger(__name__)
+
+# 連続したメッセージをまとめる待ち時間（秒、0で無効）
+TRANSLATE_COALESCE_WINDOW = float(os.getenv("TRANSLATE_COALESCE_WINDOW", 0))
+# まとめ始めてから最大で待つ時間（秒）
+TRANSLATE_COALESCE_MAX = float(os.getenv("TRANSLATE_COALESCE_MAX", 5))
+# まとめる文字数の上限（超える場合は先にまとめていた分を翻訳する）
+TRANSLATE_COALESCE_MAX_CHARS = int(os.getenv("TRANSLATE_COALESCE_MAX_CHARS", 1000))
+# 編集に追従するために覚えておくメッセージ数
+TRANSLATE_EDIT_TRACK = int(os.getenv("TRANSLATE_EDIT_TRACK", 1000))
+# 文字数制限のお知らせを出す間隔（秒）
+TRANSLATE_NOTICE_INTERVAL = float(os.getenv("TRANSLATE_NOTICE_INTERVAL", 3600))
+# Embedの文字数制限
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBED_FIELD_LIMIT = 1024
+
+def clip(text: str, limit: int) -> str:
+    """文字数制限に収まるように切り詰める"""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+class PendingGroup:
+    """まとめ待ちのメッセージ"""
+    def __init__(self):
+        self.messages: list[Message] = []
+        self.started = time.monotonic()
+        self.timer: asyncio.Task = None
+
+    def deadline(self, max_wait: float) -> float:
+        return self.started + max_wait
+
+    def length(self) -> int:
+        return sum(len(m.content) for m in self.messages)
 
 class Translate( commands.Cog ):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.auth = os.getenv("DEEPL_AUTH_KEY")
-        self.translator = deepl.Translator(self.auth) 
+        # DeepLへのアクセスは必ず翻訳サービスを経由する
+        self.limiter = QuotaLimiter()
+        self.translator = TranslationService(self.auth, cache=TranslationCache(), limiter=self.limiter)
+        # サーバーID -> 最後に文字数制限のお知らせを出した時刻
+        self._notices: dict[int, float] = {}
+
+        self.coalesce_window = TRANSLATE_COALESCE_WINDOW
+        self.coalesce_max = TRANSLATE_COALESCE_MAX
+        # (チャンネルID, ユーザーID) -> まとめ待ちのメッセージ
+        self._pending: dict[tuple[int, int], PendingGroup] = {}
+        # 元メッセージID -> (翻訳結果のメッセージ, まとめたメッセージ)
+        self._translated: OrderedDict[int, tuple[Message, list[Message]]] = OrderedDict()
+
+    async def cog_load(self):
+        # 使用量はDBが設定されていれば保存する
+        if os.getenv("DB_HOST"):
+            try:
+                # DBモジュールはmariadbが必要なので使うときに読み込む
+                from modules.database.general import GeneralManager, translate_settings
+                db = await asyncio.to_thread(
+                    GeneralManager,
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASS"),
+                    host=os.getenv("DB_HOST"),
+                    port=int(os.getenv("DB_PORT", 3306)),
+                    database=os.getenv("DB_NAME", "autotranslator")
+                )
+                await asyncio.to_thread(db.create_or_update_table, "translate_settings", translate_settings)
+                self.limiter.db = db
+            except Exception as e:
+                logger.error(f"翻訳の使用量をDBに保存できません: {e}")
+        self.flush_usage.start()
+
+    async def cog_unload(self):
+        for group in self._pending.values():
+            if group.timer:
+                group.timer.cancel()
+        self._pending.clear()
+        self.flush_usage.cancel()
+        await asyncio.to_thread(self.limiter.flush)
+        self.translator.close()
+
+    @tasks.loop(seconds=60)
+    async def flush_usage(self):
+        try:
+            await asyncio.to_thread(self.limiter.flush)
+        except Exception as e:
+            logger.error(f"翻訳の使用量を保存できませんでした: {e}")
 
     @commands.Cog.listener()
     async def on_message(self, message: Message):
         #ignore bot
         if message.author.bot:
             return
-        
-        if (self.translator):
-            try:
-                sentence = message.content
-                
-                target_lang = None
-                try:
-                    # detect language
-                    detected_lang = langdetect.detect(sentence)
-                    
-                    # translate
-                    if (detected_lang == "ja"):
-                        target_lang = "EN-US"
-                    elif (detected_lang == "en"):
-                        target_lang = "JA"
-                except:
+
+        if not self.translator.available:
+            return
+
+        if self.coalesce_window <= 0:
+            await self._send_translation([message])
+            return
+
+        # 同じ人の連続したメッセージはまとめて翻訳する
+        key = (message.channel.id, message.author.id)
+        group = self._pending.get(key)
+        if group and group.length() + len(message.content) > TRANSLATE_COALESCE_MAX_CHARS:
+            # 長くなりすぎる場合はまとめていた分を先に翻訳する
+            del self._pending[key]
+            if group.timer:
+                group.timer.cancel()
+            group.timer = asyncio.create_task(self._flush_later(key, group, 0))
+            group = None
+        if group is None:
+            group = self._pending[key] = PendingGroup()
+        group.messages.append(message)
+
+        if group.timer:
+            group.timer.cancel()
+        delay = min(self.coalesce_window, group.deadline(self.coalesce_max) - time.monotonic())
+        group.timer = asyncio.create_task(self._flush_later(key, group, max(0, delay)))
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: Message, after: Message):
+        if after.author.bot or before.content == after.content:
+            return
+
+        # まだまとめ待ちなら差し替えるだけ
+        for group in self._pending.values():
+            for i, pending in enumerate(group.messages):
+                if pending.id == after.id:
+                    group.messages[i] = after
                     return
-                
-                if target_lang:
-                    result = self.translator.translate_text(sentence, target_lang=target_lang)
-                else:
-                    result = sentence
-                
-                if result:
-                    embed = Embed(title=result, description=f"{sentence}", color=Color.green())
-                    
-                    if not target_lang:
-                        lang_convert = "original message"
-                    else:
-                        lang_convert = f"{detected_lang} -> {target_lang}"
-                       
-                    embed.set_author(name=f"Sended by {message.author.display_name}", icon_url=message.author.display_avatar.url)
-                    
-                    embed.set_footer(text=lang_convert)
-                    
-                else:
-                    embed = Embed(title="Failed to Translate...", description="oh, my bot stopped working.")
-                    
-                await message.channel.send(embed=embed)
+
+        # 翻訳済みなら元のEmbedを更新する
+        entry = self._translated.get(after.id)
+        if not entry:
+            return
+        sent, messages = entry
+        messages = [after if m.id == after.id else m for m in messages]
+        for m in messages:
+            self._translated[m.id] = (sent, messages)
+
+        try:
+            embed = await self._make_embed(messages)
+            if embed:
+                await sent.edit(embed=embed)
+        except Exception as e:
+            logger.error(f"翻訳の更新に失敗しました: {e}")
+
+    async def _flush_later(self, key: tuple, group: "PendingGroup", delay: float):
+        await asyncio.sleep(delay)
+        if self._pending.get(key) is group:
+            del self._pending[key]
+        await self._send_translation(group.messages)
+
+    async def _make_embed(self, messages: list[Message]):
+        """メッセージ（複数可）を翻訳してEmbedを作る（翻訳しない場合はNone）"""
+        message = messages[0]
+        sentence = "\n".join(m.content for m in messages if m.content)
+
+        # URL・絵文字・メンション・コードブロックなどを取り除く
+        masked = mask_text(sentence)
+        if not masked.translatable:
+            return None
+
+        target_lang = None
+
+        # detect language
+        detected_lang = detect_language(masked.plain)
+        if not detected_lang:
+            return None
+
+        # translate
+        if (detected_lang == "ja"):
+            target_lang = "EN-US"
+        elif (detected_lang == "en"):
+            target_lang = "JA"
+
+        if target_lang:
+            translated = await self.translator.translate(
+                masked.masked, target_lang,
+                guild_id=message.guild.id if message.guild else None,
+                source_lang=detected_lang,
+                **masked.options
+            )
+            result = masked.restore(translated)
+        else:
+            result = sentence
+
+        if result:
+            # タイトルは256文字までなので翻訳結果は本文に入れる
+            embed = Embed(description=clip(result, EMBED_DESCRIPTION_LIMIT), color=Color.green())
+            if target_lang:
+                embed.add_field(name="Original", value=clip(sentence, EMBED_FIELD_LIMIT), inline=False)
+
+            if not target_lang:
+                lang_convert = "original message"
+            else:
+                lang_convert = f"{detected_lang} -> {target_lang}"
+
+            embed.set_author(name=f"Sended by {message.author.display_name}", icon_url=message.author.display_avatar.url)
+
+            embed.set_footer(text=lang_convert)
+
+        else:
+            embed = Embed(title="Failed to Translate...", description="oh, my bot stopped working.")
+
+        return embed
+
+    async def _send_translation(self, messages: list[Message]):
+        """翻訳結果を送信し、編集に備えて記録する"""
+        channel = messages[0].channel
+        try:
+            embed = await self._make_embed(messages)
+            if not embed:
                 return
-            
-            except Exception as e:
-                embed = Embed(title="Failed to Translate...", description=f"oh, my bot stopped working.\n ```{e}```")     
-                await message.channel.send(embed=embed)
-                
+
+            sent = await channel.send(embed=embed)
+
+            for m in messages:
+                self._translated[m.id] = (sent, messages)
+            while len(self._translated) > TRANSLATE_EDIT_TRACK:
+                self._translated.popitem(last=False)
+
+            if messages[0].guild and self.limiter.is_low(messages[0].guild.id):
+                await self._send_quota_notice(channel, messages[0].guild.id, exhausted=False)
+
+        except QuotaExceeded as e:
+            # 制限中はキャッシュにあるものだけ翻訳する
+            await self._send_quota_notice(channel, e.guild_id, exhausted=True)
+
+        except Exception as e:
+            embed = Embed(title="Failed to Translate...", description=f"oh, my bot stopped working.\n ```{e}```")
+            await channel.send(embed=embed)
+
+    async def _send_quota_notice(self, channel, guild_id: int, exhausted: bool):
+        """文字数制限のお知らせ（一定時間に1回まで）"""
+        now = time.monotonic()
+        if now - self._notices.get(guild_id, -TRANSLATE_NOTICE_INTERVAL) < TRANSLATE_NOTICE_INTERVAL:
+            return
+        self._notices[guild_id] = now
+
+        if exhausted:
+            embed = Embed(
+                title="Translation quota reached",
+                description="This server is translating too much right now. Only previously translated messages will be translated for a while.",
+                color=Color.orange()
+            )
+        else:
+            embed = Embed(
+                title="Translation quota low",
+                description="This server has used most of its monthly translation quota.",
+                color=Color.yellow()
+            )
+        await channel.send(embed=embed)
+
     @app_commands.command(name="translate", description="翻訳コマンドなのだ")
     @app_commands.choices(target_lang=[
         Choice(name="English (US)", value="EN-US"),
@@ -74,8 +277,24 @@ class Translate( commands.Cog ):
     ])
     @app_commands.rename(target_lang="target_language")
     async def translate(self, interact: Interaction, sentence: str, target_lang: str):
-        if (self.translator):
-            result = self.translator.translate_text(sentence, target_lang=target_lang)
+        if not self.translator.available:
+            embed = Embed(title="Failed to Translate...", description="DeepL is not configured.")
+            await interact.response.send_message(embed=embed, ephemeral=True)
+            return
+
+        # 翻訳に3秒以上かかってもタイムアウトしないようにする
+        await interact.response.defer()
+        try:
+            result = await self.translator.translate(sentence, target_lang, guild_id=interact.guild_id)
+        except QuotaExceeded:
+            embed = Embed(title="Failed to Translate...", description="Translation quota reached. Please try again later.")
+            await interact.followup.send(embed=embed, ephemeral=True)
+            return
+        except Exception as e:
+            # deferした後は応答を返さないと「考え中」のまま残るのでfollowupで伝える
+            embed = Embed(title="Failed to Translate...", description=f"oh, my bot stopped working.\n ```{e}```")
+            await interact.followup.send(embed=embed)
+            return
 
         embed = Embed(
             title="Done!",
@@ -95,6 +314,56 @@ class Translate( commands.Cog ):
         embed.set_thumbnail(url=f"attachment://boticon_zunda.png")
         embed.set_footer(text=f"DeepL Translate", icon_url="https://cdn.freelogovectors.net/wp-content/uploads/2022/01/deepl-logo-freelogovectors.net_.png")
 
+        await interact.followup.send(embed=embed)
+
+    @app_commands.command(name="translate_stats", description="翻訳の統計情報を表示するのだ")
+    async def translate_stats(self, interact: Interaction):
+        stats = self.translator.stats()
+
+        embed = Embed(title="Translate Stats", color=Color.green())
+        embed.add_field(name="Queue depth", value=stats["queue_depth"])
+        embed.add_field(name="Running", value=stats["running"])
+        embed.add_field(name="Completed", value=stats["completed"])
+        embed.add_field(name="Failed", value=stats["failed"])
+        embed.add_field(name="Requests", value=stats["requests"])
+        embed.add_field(name="Avg batch size", value=f"{stats['avg_batch']:.2f}")
+
+        cache = stats["cache"]
+        if cache:
+            embed.add_field(
+                name="Cache",
+                value=(
+                    f"hit: {cache['hits']} / disk hit: {cache['disk_hits']} / miss: {cache['misses']}"
+                    f" ({cache['hit_rate']*100:.1f}%)\n"
+                    f"evicted: {cache['evictions']} / disk evicted: {cache['disk_evictions']} / expired: {cache['expired']}\n"
+                    f"saved chars: {cache['saved_chars']} / memory: {cache['memory_bytes']} bytes ({cache['memory_entries']} entries)"
+                ),
+                inline=False
+            )
+
+        await interact.response.send_message(embed=embed)
+
+    @app_commands.command(name="translate_usage", description="翻訳の使用量を表示するのだ")
+    async def translate_usage(self, interact: Interaction):
+        await self.limiter.ensure_loaded(interact.guild_id)
+        report = self.limiter.report(interact.guild_id)
+
+        embed = Embed(title="Translate Usage", description=f"Period: {report['period']}", color=Color.green())
+        embed.add_field(
+            name="This server",
+            value=f"{report['guild_used']:,} / {report['guild_limit']:,} chars",
+            inline=False
+        )
+        embed.add_field(
+            name="All servers",
+            value=f"{report['global_used']:,} / {report['global_limit']:,} chars",
+            inline=False
+        )
+        if report["guild_bucket"] is not None:
+            embed.add_field(name="Server bucket", value=f"{report['guild_bucket']:.0f} chars")
+        embed.add_field(name="Global bucket", value=f"{report['global_bucket']:.0f} chars")
+        embed.add_field(name="Denied", value=report["denied"])
+
         await interact.response.send_message(embed=embed)
 
 async def setup(bot: commands.Bot) -> None:
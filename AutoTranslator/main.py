@@ -80,6 +80,10 @@ async def on_ready():
     await tree.sync()
     logger.info(f"起動処理完了 起動しました({bot.user})")
 
+    # VOICEVOXの話者のモデルをバックグラウンドで読み込む（待たない）
+    from modules.vc.tts.warmup import start_warmup
+    start_warmup()
+
 # 実行
 bot.run(token)
     
\ No newline at end of file
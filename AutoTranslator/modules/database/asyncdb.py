@@ -0,0 +1,142 @@
+import asyncio
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from modules.database.pool import DB_POOL_SIZE
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# DBの処理に使うスレッド数（プールの接続数より多くしても待つだけ）
+DB_ASYNC_WORKERS = int(os.getenv("DB_ASYNC_WORKERS", DB_POOL_SIZE))
+
+# すべてのAsyncDatabaseで共有する専用のスレッド
+_executor: ThreadPoolExecutor = None
+# 接続を借りた後のトランザクションの処理に使うスレッド
+# （同じスレッドで行うと、接続待ちでスレッドが埋まったときにコミット・返却ができず止まる）
+_transaction_executor: ThreadPoolExecutor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_ASYNC_WORKERS, thread_name_prefix="database")
+    return _executor
+
+def get_transaction_executor() -> ThreadPoolExecutor:
+    global _transaction_executor
+    if _transaction_executor is None:
+        _transaction_executor = ThreadPoolExecutor(max_workers=DB_ASYNC_WORKERS, thread_name_prefix="database-tx")
+    return _transaction_executor
+
+
+class Transaction:
+    """1つの接続で行う明示的なトランザクション
+
+    async with db.transaction() as tx:
+        rows = await tx.fetchall("SELECT ...")
+        await tx.execute("UPDATE ...")
+    抜けるときに例外が無ければコミット、あればロールバックする。
+    接続を借りた後の処理は接続待ちで埋まらない別のスレッドで行う。
+    """
+
+    def __init__(self, db: "AsyncDatabase"):
+        self.db = db
+        self.conn = None
+
+    async def run(self, func, *args):
+        """借りた接続を使う処理をトランザクション用のスレッドで実行する"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_transaction_executor(), partial(func, *args))
+
+    async def __aenter__(self) -> "Transaction":
+        self.conn = await self.db.run(self.db.pool.acquire)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.run(self.conn.commit)
+            else:
+                await self.run(self.conn.rollback)
+        finally:
+            await self.run(self.db.pool.release, self.conn)
+            self.conn = None
+
+    def _execute(self, query, params, fetch: bool, many: bool = False):
+        cursor = self.conn.cursor()
+        try:
+            if many:
+                cursor.executemany(query, params)
+            else:
+                cursor.execute(query, params or ())
+            return cursor.fetchall() if fetch else cursor.rowcount
+        finally:
+            cursor.close()
+
+    async def execute(self, query, params=None) -> int:
+        """更新系のクエリを実行して影響した行数を返す"""
+        return await self.run(self._execute, query, params, False)
+
+    async def executemany(self, query, params_list) -> int:
+        return await self.run(self._execute, query, params_list, False, True)
+
+    async def fetchall(self, query, params=None) -> list:
+        return await self.run(self._execute, query, params, True)
+
+
+class AsyncDatabase:
+    """マネージャーをイベントループから使うための非同期の窓口
+
+    処理はすべて専用のスレッドで行い、discordのイベントループを止めない。
+    get_setting / save_setting / get_dict / save_dict は元のマネージャーと同じ動作。
+    """
+
+    def __init__(self, manager, executor: ThreadPoolExecutor = None):
+        self.manager = manager
+        self._executor = executor or get_executor()
+
+    @property
+    def pool(self):
+        return self.manager.pool
+
+    async def run(self, func, *args, **kwargs):
+        """同期の処理を専用のスレッドで実行する"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    async def execute_query(self, query, params=None, fetch=False):
+        return await self.run(self.manager.execute_query, query, params, fetch)
+
+    async def table_exists(self, table_name: str) -> bool:
+        return await self.run(self.manager.table_exists, table_name)
+
+    # GeneralManager
+    async def get_setting(self, table_name: str, primary_id: int, name: str) -> any:
+        return await self.run(self.manager.get_setting, table_name, primary_id, name)
+
+    async def save_setting(self, table_name: str, primary_id: int, settings: any):
+        return await self.run(self.manager.save_setting, table_name, primary_id, settings)
+
+    async def get_settings(self, table_name: str, primary_id: int, columns: list[str] = None) -> dict:
+        return await self.run(self.manager.get_settings, table_name, primary_id, columns)
+
+    async def get_many(self, table_name: str, primary_ids: list[int], columns: list[str] = None) -> dict[int, dict]:
+        return await self.run(self.manager.get_many, table_name, primary_ids, columns)
+
+    async def save_many(self, table_name: str, settings: dict[int, dict]) -> bool:
+        return await self.run(self.manager.save_many, table_name, settings)
+
+    async def create_or_update_table(self, table_name: str, columns: list[tuple[str, str]]):
+        return await self.run(self.manager.create_or_update_table, table_name, columns)
+
+    # DictionaryManager / SoundtextManager
+    async def get_dict(self, server_id):
+        return await self.run(self.manager.get_dict, server_id)
+
+    async def save_dict(self, server_id, settings):
+        return await self.run(self.manager.save_dict, server_id, settings)
@@ -0,0 +1,129 @@
+import time
+import os
+
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 1回に移行する行数
+DICT_MIGRATE_BATCH = int(os.getenv("DICT_MIGRATE_BATCH", 500))
+# 移行が終わったサーバーごとのテーブルを削除するか（0なら migrated_{id} に名前を変えて残す）
+DICT_DROP_MIGRATED = os.getenv("DICT_DROP_MIGRATED", "0") == "1"
+# 統合テーブルのwordの最大文字数（(guild_id, word)の一意キーに入れるためVARCHARにする）
+WORD_MAX_LENGTH = 255
+
+
+def list_legacy_tables(manager) -> set[int]:
+    """サーバーごとのテーブル（名前がサーバーID）の一覧（取得できなければNone）"""
+    result = manager.execute_query("SHOW TABLES", fetch=True)
+    if result is None:
+        return None
+    return {int(row[0]) for row in result if str(row[0]).isdigit()}
+
+
+def _execute_many(manager, query, params_list) -> bool:
+    with manager.pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(query, params_list)
+            conn.commit()
+        finally:
+            cursor.close()
+    return True
+
+
+def _vanished(manager, table_name: str, server_id: int, copied: int = 0) -> int:
+    """読み込みに失敗したとき、テーブルが無くなっていれば移行済みとして扱う（残っていればNone）"""
+    if manager.execute_query(f"SHOW TABLES LIKE '{server_id}'", fetch=True) == []:
+        # 別の移行（ツールや他のプロセス）が先に終わらせてテーブルが無くなった
+        logger.info(f"{table_name}: サーバー {server_id} はすでに移行されています")
+        return copied
+    return None
+
+
+def migrate_guild(manager, table_name: str, server_id: int, columns: list[str],
+                  batch_size: int = DICT_MIGRATE_BATCH, pause: float = 0) -> int:
+    """サーバーごとのテーブルを統合テーブルへコピーする（コピーした行数、失敗したらNone）
+
+    すでに統合テーブルにある単語は上書きしない（移行中に登録されたものを優先する）。
+    """
+    legacy = f"`{server_id}`"
+    # 重複したときだけ何もしない（INSERT IGNOREだと切り詰めなどのエラーも警告になって消える）
+    insert = f"""
+        INSERT INTO {table_name} (guild_id, {", ".join(columns)})
+        VALUES (%s, {", ".join(["%s"] * len(columns))})
+        ON DUPLICATE KEY UPDATE id = id
+    """
+
+    longest = manager.execute_query(f"SELECT MAX(CHAR_LENGTH(word)) FROM {legacy}", fetch=True)
+    if longest is None:
+        return _vanished(manager, table_name, server_id)
+    if (longest[0][0] or 0) > WORD_MAX_LENGTH:
+        # 切り詰めると別の単語と重なって消えるので移行しない
+        logger.error(f"{table_name}: サーバー {server_id} に {WORD_MAX_LENGTH} 文字を超える単語があるため移行できません")
+        return None
+
+    copied = 0
+    last_id = 0
+    while True:
+        rows = manager.execute_query(
+            f"SELECT id, {', '.join(columns)} FROM {legacy} WHERE id > %s ORDER BY id LIMIT %s",
+            [last_id, batch_size], fetch=True
+        )
+        if rows is None:
+            # エラー（SELECTが成功して空なら[]が返る）
+            return _vanished(manager, table_name, server_id, copied)
+        if not rows:
+            break
+
+        try:
+            _execute_many(manager, insert, [[server_id, *row[1:]] for row in rows])
+        except Exception as e:
+            logger.error(f"移行エラー: {server_id} {e}")
+            return None
+        copied += len(rows)
+        last_id = rows[-1][0]
+        if pause:
+            # 稼働中のDBに負荷をかけすぎないように少し待つ
+            time.sleep(pause)
+
+    if DICT_DROP_MIGRATED:
+        manager.execute_query(f"DROP TABLE {legacy}")
+    else:
+        manager.execute_query(f"RENAME TABLE {legacy} TO `migrated_{server_id}`")
+    logger.info(f"{table_name}: サーバー {server_id} を移行しました ({copied}件)")
+    return copied
+
+
+# ==============================
+# 移行ツール
+# ==============================
+# AutoTranslatorディレクトリで `python -m modules.database.consolidate dictionary <データベース名>` を実行
+# （soundtextも同様）。botを動かしたままでも実行でき、未移行のサーバーは使われたときにも移行される。
+if __name__ == "__main__":
+    import dotenv
+    import sys
+
+    dotenv.load_dotenv()
+    kind, database = sys.argv[1], sys.argv[2]
+    pause = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+
+    if kind == "dictionary":
+        from modules.database.dictionary import DictionaryManager as Manager
+    else:
+        from modules.database.soundtext import SoundtextManager as Manager
+
+    db = Manager(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 3306)),
+        database=database
+    )
+    start = time.perf_counter()
+    result = db.migrate_all(pause=pause)
+    if result is None:
+        sys.exit("統合テーブルを準備できませんでした（DBの接続を確認してください）")
+    print(f"移行完了: {result['migrated']}サーバー、 {result['rows']}件、 失敗 {result['failed']} ({time.perf_counter() - start:.1f}s)")
+    db.close()
@@ -8,9 +8,11 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(parent_dir)
 
 import log
+from modules.database.pool import DatabasePool, get_pool
+from modules.database.settings_cache import SettingsCache, settings_cache
 
 class GeneralManager:
-    def __init__(self, user, password, host, port, database, max_retries=3):
+    def __init__(self, user, password, host, port, database, max_retries=3, cache: SettingsCache = settings_cache):
 
         self.logger = log.get_logger(__name__)
         
@@ -22,40 +24,18 @@ class GeneralManager:
         }
         self.database = database
         self.max_retries = max_retries
-        self.conn = None
-        self.cursor = None
+        self.cache = cache
+        self.pool: DatabasePool = None
         self.connect_db()
 
     def connect_db(self):
-        """データベースに接続（存在しなければ作成）"""
-        try:
-            # まず通常の接続を試す
-            self.conn = mariadb.connect(**self.db_config, database=self.database)
-            self.cursor = self.conn.cursor()
-            self.logger.info(f"MariaDBに接続しました（データベース: {self.database}）")
-        except mariadb.Error as e:
-            if "Unknown database" in str(e):
-                self.logger.info(f"データベース '{self.database}' が存在しません。作成します...")
-                self.create_database()
-            else:
-                self.logger.error(f"データベース接続エラー: {e}")
-                self.conn = None
-                self.cursor = None
+        """共有の接続プールを取得（データベースが存在しなければ最初の接続時に作成）"""
+        self.pool = get_pool(**self.db_config, database=self.database)
 
     def create_database(self):
-        """データベースを作成して再接続"""
+        """データベースを作成"""
         try:
-            # データベースなしで接続（データベース作成のため）
-            temp_conn = mariadb.connect(**self.db_config)
-            temp_cursor = temp_conn.cursor()
-            temp_cursor.execute(f"CREATE DATABASE {self.database}")
-            temp_conn.commit()
-            temp_cursor.close()
-            temp_conn.close()
-            self.logger.info(f"データベース '{self.database}' を作成しました")
-
-            # 再接続
-            self.connect_db()
+            self.pool.create_database()
         except mariadb.Error as e:
             self.logger.error(f"データベース作成エラー: {e}")
 
@@ -63,33 +43,56 @@ class GeneralManager:
         """SQLクエリを実行し、必要に応じて結果を取得"""
         for attempt in range(1, self.max_retries + 1):
             try:
-                if not self.conn or not self.cursor:
-                    self.logger.info(f"データベースに再接続中... ({attempt}/{self.max_retries})")
-                    self.connect_db()
-
-                if not self.conn or not self.cursor:
-                    raise mariadb.OperationalError("データベースに接続できません")
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(query, params or ())
+
+                        # `SHOW` クエリや `SELECT` の場合のみ fetch する（読み取りはコミットしない）
+                        if fetch:
+                            result = cursor.fetchall()
+                        else:
+                            # 成功したことが分かるようにTrueを返す
+                            result = True
+                            conn.commit()
+                    finally:
+                        cursor.close()
+                return result
 
-                self.cursor.execute(query, params or ())
-                self.conn.commit()
+            except mariadb.OperationalError as e:
+                self.logger.error(f"接続エラー: {e} ({attempt}/{self.max_retries})")
+                if attempt < self.max_retries:
+                    self.pool.backoff(attempt)
+            except mariadb.Error as e:
+                self.logger.error(f"クエリエラー: {e} \n クエリ: {query}")
+                return None
 
-                # `SHOW` クエリや `SELECT` の場合のみ fetch する
-                if fetch:
-                    return self.cursor.fetchall()
+        self.logger.error("リトライ回数を超過しました。クエリ実行を中止します。")
+        return None
 
-                return None
+    def execute_many(self, query, params_list) -> bool:
+        """同じクエリをまとめて実行する（1つのトランザクション）"""
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.executemany(query, params_list)
+                        conn.commit()
+                    finally:
+                        cursor.close()
+                return True
 
             except mariadb.OperationalError as e:
-                self.logger.error(f"接続エラー: {e}")
-                self.conn = None
-                self.cursor = None
-                time.sleep(1)
+                self.logger.error(f"接続エラー: {e} ({attempt}/{self.max_retries})")
+                if attempt < self.max_retries:
+                    self.pool.backoff(attempt)
             except mariadb.Error as e:
-                self.logger.exception(f"SQLエラー: {e}")
-                return None
+                self.logger.error(f"クエリエラー: {e} \n クエリ: {query}")
+                return False
 
-        print("リトライ回数を超過しました。クエリ実行を中止します。")
-        return None
+        self.logger.error("リトライ回数を超過しました。クエリ実行を中止します。")
+        return False
 
     def table_exists(self, table_name: str) -> bool:
         """テーブルが存在するかチェック"""
@@ -97,10 +100,30 @@ class GeneralManager:
         result = self.execute_query(f"SHOW TABLES LIKE '{table_name}'", fetch=True)
         return bool(result)
 
+    def load_row(self, table_name: str, primary_id: int):
+        """設定の行をまるごと読み込んでキャッシュする（無ければNone）"""
+        columns = self.cache.columns(table_name)
+        generation = self.cache.begin_load()
+        result = self.execute_query(
+            f"SELECT {', '.join(columns)} FROM {table_name} WHERE id = %s", [primary_id], fetch=True
+        )
+        if not result:
+            return None
+        return self.cache.put(self.database, table_name, primary_id, dict(zip(columns, result[0])), generation)
+
     def get_setting(self, table_name: str, primary_id: int, name: str) -> any:
         """データベースから設定を取得し、存在しなければデフォルト値で作成"""
         self.logger.debug(f"Getting setting '{name}' from table '{table_name}' for ID {primary_id}...")
 
+        # 設定リストがあるテーブルは行ごとキャッシュから返す
+        if self.cache and self.cache.cacheable(table_name, name):
+            row = self.cache.get(self.database, table_name, primary_id) or self.load_row(table_name, primary_id)
+            if row is None:
+                self.logger.info(f"Setting '{name}' not found for ID {primary_id}. Creating with default value...")
+                self.save_setting(table_name, primary_id, None)
+                row = self.load_row(table_name, primary_id)
+            return row[name] if row else None
+
         # クエリを動的に作成
         query = f"SELECT {name} FROM {table_name} WHERE id = %s"
         
@@ -139,7 +162,110 @@ class GeneralManager:
             """
             values = [primary_id]
 
-        self.execute_query(query, values)
+        success = self.execute_query(query, values)
+
+        # キャッシュにも書き込む（失敗したときは捨てて次に読み直す）
+        # 覚えていない行も書き込んだことを記録し、読み込み中の古い行がキャッシュされないようにする
+        if self.cache and self.cache.cacheable(table_name):
+            if success and settings:
+                self.cache.update(self.database, table_name, primary_id, settings)
+            else:
+                self.cache.invalidate(self.database, table_name, primary_id)
+
+    def _row(self, table_name: str, columns: list[str], values) -> dict:
+        row = dict(zip(columns, values))
+        return self.cache.coerce(table_name, row) if self.cache and self.cache.cacheable(table_name) else row
+
+    def get_settings(self, table_name: str, primary_id: int, columns: list[str] = None) -> dict:
+        """複数の設定を1回で取得する（存在しなければデフォルト値で作成）"""
+        if self.cache and self.cache.cacheable(table_name) and all(self.cache.cacheable(table_name, c) for c in columns or []):
+            row = self.cache.get(self.database, table_name, primary_id) or self.load_row(table_name, primary_id)
+            if row is None:
+                self.save_setting(table_name, primary_id, None)
+                row = self.load_row(table_name, primary_id)
+            if row is None:
+                return None
+            return {c: row[c] for c in columns} if columns else dict(row)
+
+        if not columns:
+            columns = list(self.get_existing_columns(table_name))
+        query = f"SELECT {', '.join(columns)} FROM {table_name} WHERE id = %s"
+        result = self.execute_query(query, [primary_id], fetch=True)
+        if not result:
+            self.save_setting(table_name, primary_id, None)
+            result = self.execute_query(query, [primary_id], fetch=True)
+        return self._row(table_name, columns, result[0]) if result else None
+
+    def get_many(self, table_name: str, primary_ids: list[int], columns: list[str] = None) -> dict[int, dict]:
+        """複数のIDの設定を1回で取得する（存在しないIDは含まない、作成もしない）"""
+        primary_ids = list(dict.fromkeys(primary_ids))
+        if not primary_ids:
+            return {}
+
+        cacheable = self.cache and self.cache.cacheable(table_name)
+        if columns is None:
+            columns = self.cache.columns(table_name) if cacheable else list(self.get_existing_columns(table_name))
+
+        rows = {}
+        missing = primary_ids
+        if cacheable:
+            missing = []
+            for primary_id in primary_ids:
+                row = self.cache.get(self.database, table_name, primary_id)
+                if row is None:
+                    missing.append(primary_id)
+                else:
+                    rows[primary_id] = {c: row[c] for c in columns}
+
+        if missing:
+            # 読み込むならキャッシュできるように行をまるごと読む
+            select = self.cache.columns(table_name) if cacheable else list(dict.fromkeys(["id", *columns]))
+            generation = self.cache.begin_load() if cacheable else None
+            result = self.execute_query(
+                f"SELECT {', '.join(select)} FROM {table_name} WHERE id IN ({', '.join(['%s'] * len(missing))})",
+                missing, fetch=True
+            )
+            for values in result or []:
+                row = self._row(table_name, select, values)
+                if cacheable:
+                    self.cache.put(self.database, table_name, row["id"], row, generation)
+                rows[row["id"]] = {c: row[c] for c in columns}
+
+        return {primary_id: rows[primary_id] for primary_id in primary_ids if primary_id in rows}
+
+    def save_many(self, table_name: str, settings: dict[int, dict]) -> bool:
+        """複数のIDの設定をexecutemanyでまとめて保存する（既存なら更新、なければ追加）"""
+        # 保存するカラムが同じものごとにまとめる
+        groups: dict[tuple[str, ...], list[int]] = {}
+        for primary_id, values in settings.items():
+            groups.setdefault(tuple(values.keys()), []).append(primary_id)
+
+        success = True
+        for keys, primary_ids in groups.items():
+            if keys:
+                query = f"""
+                    INSERT INTO {table_name} (id, {", ".join(keys)})
+                    VALUES (%s, {", ".join(["%s"] * len(keys))})
+                    ON DUPLICATE KEY UPDATE {", ".join([f"{k}=VALUES({k})" for k in keys])}
+                """
+            else:
+                query = f"INSERT IGNORE INTO {table_name} (id) VALUES (%s)"
+            params = [[primary_id, *settings[primary_id].values()] for primary_id in primary_ids]
+            ok = self.execute_many(query, params)
+            success = success and ok
+
+            if self.cache and self.cache.cacheable(table_name):
+                for primary_id in primary_ids:
+                    if ok and keys:
+                        self.cache.update(self.database, table_name, primary_id, settings[primary_id])
+                    else:
+                        self.cache.invalidate(self.database, table_name, primary_id)
+        return success
+
+    def invalidate(self, table_name: str = None, primary_id: int = None):
+        """キャッシュした設定を捨てる（DBを直接書き換えたときなど）"""
+        if self.cache:
+            self.cache.invalidate(self.database, table_name, primary_id)
 
     def get_existing_columns(self, table_name):
         """データベースから既存のカラムリストを取得"""
@@ -167,13 +293,11 @@ class GeneralManager:
             if column not in existing_columns:
                 self.logger.info(f"カラム追加: {column} {new_col_type}")
                 self.execute_query(f"ALTER TABLE {table_name} ADD COLUMN {column} {new_col_type}")
+                self.invalidate(table_name)
 
     def close(self):
-        """データベース接続を閉じる"""
-        if self.conn:
-            self.cursor.close()
-            self.conn.close()
-            self.logger.info("データベース接続を閉じました")
+        """プールは他のマネージャーと共有しているので参照だけ外す（閉じるのはclose_pools）"""
+        self.pool = None
 
 
 # ==============================
@@ -209,6 +333,73 @@ tts_status = [
     ("tts_total", "INTEGER DEFAULT 0"),
 ]
 
+translate_settings = [
+    ("id", "BIGINT PRIMARY KEY"),  # PRIMARY KEY (0: 全体)
+    ("char_limit", "BIGINT DEFAULT NULL"),            # [Monthly Character Limit] Null (Default) or Number
+    ("chars_used", "BIGINT NOT NULL DEFAULT 0"),      # [Characters Used This Period]
+    ("period", "INTEGER NOT NULL DEFAULT 0"),         # [Period] YYYYMM
+]
+
+# 設定リストのあるテーブルは行ごとキャッシュする
+for _table_name, _columns in {
+    "other_settings": other_settings,
+    "tts_settings": tts_settings,
+    "user_settings": user_settings,
+    "tts_status": tts_status,
+    "translate_settings": translate_settings,
+}.items():
+    settings_cache.register(_table_name, _columns)
+
+# ==============================
+# ベンチマーク
+# ==============================
+# AutoTranslatorディレクトリで `python -m modules.database.general` を実行（.envのMariaDBを使う）。
+# 自動接続の起動処理（全サーバーのauto_chとtext_ch）をカラムごとの取得とまとめての取得で比べる。
+# 最後にtts_settingsを削除するので、BotのDB（DB_NAME）とは別のBENCH_DB_NAMEで実行する。
+# 結果はDBサーバーとの距離で大きく変わるので、比べるときは同じ環境で測る。
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    if not os.getenv("DB_HOST"):
+        sys.exit("DB_HOST が設定されていません（ベンチマークにはMariaDBが必要です）")
+    bench_database = os.getenv("BENCH_DB_NAME", "autotranslator_bench")
+    if bench_database == os.getenv("DB_NAME", "autotranslator"):
+        sys.exit("BENCH_DB_NAME がBotのDB（DB_NAME）と同じです（ベンチマークはtts_settingsを削除します）")
+    GUILDS = int(os.getenv("BENCH_GUILDS", 1000))
+    db = GeneralManager(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 3306)),
+        database=bench_database,
+        cache=None
+    )
+    db.create_or_update_table("tts_settings", tts_settings)
+    ids = list(range(1, GUILDS + 1))
+    version = db.execute_query("SELECT VERSION()", fetch=True)
+    print(f"server         : {db.db_config['host']}:{db.db_config['port']} {version[0][0] if version else 'unknown'}")
+
+    start = time.perf_counter()
+    db.save_many("tts_settings", {i: {"auto_ch": i * 10, "text_ch": i * 10 + 1} for i in ids})
+    print(f"save_many      : {time.perf_counter() - start:7.3f} s ({GUILDS} rows)")
+
+    start = time.perf_counter()
+    for i in ids:
+        db.get_setting("tts_settings", i, "auto_ch")
+        db.get_setting("tts_settings", i, "text_ch")
+    print(f"per column     : {time.perf_counter() - start:7.3f} s ({GUILDS * 2} queries)")
+
+    start = time.perf_counter()
+    for i in ids:
+        db.get_settings("tts_settings", i, ["auto_ch", "text_ch"])
+    print(f"get_settings   : {time.perf_counter() - start:7.3f} s ({GUILDS} queries)")
+
+    start = time.perf_counter()
+    rows = db.get_many("tts_settings", ids, ["auto_ch", "text_ch"])
+    print(f"get_many       : {time.perf_counter() - start:7.3f} s (1 query, {len(rows)} rows)")
+
+    db.execute_query("DROP TABLE tts_settings")
+    db.close()
+
 # ==============================
 # 使い方
 # ==============================
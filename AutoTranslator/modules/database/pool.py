@@ -0,0 +1,213 @@
+import threading
+import asyncio
+import random
+import time
+import os
+
+import mariadb
+
+from contextlib import contextmanager
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 1つのデータベースあたりの接続数
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+# 空きの接続を待つ最大時間（秒）
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# 再試行の待ち時間（秒、試行ごとに倍になる）
+DB_RETRY_BACKOFF = float(os.getenv("DB_RETRY_BACKOFF", 0.5))
+
+
+class PoolTimeout(mariadb.OperationalError):
+    """空きの接続を待ちきれなかった"""
+
+
+class DatabasePool:
+    """すべてのマネージャーで共有するMariaDBの接続プール"""
+
+    def __init__(self, user, password, host, port, database, pool_size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.db_config = {
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": port,
+        }
+        self.database = database
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._pool: mariadb.ConnectionPool = None
+        self._cond = threading.Condition()
+        self._in_use = 0
+        # イベントループのスレッドから使われたことを警告したか
+        self._warned_loop = False
+
+        # 統計
+        self.checkouts = 0
+        self.timeouts = 0
+        self.health_failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_in_use = 0
+
+    def _create_pool(self):
+        """接続プールを作る（データベースが無ければ作成する）"""
+        config = dict(self.db_config, database=self.database)
+        name = f"{self.database}_{self.db_config['host']}_{self.db_config['port']}_{id(self)}"
+        try:
+            self._pool = mariadb.ConnectionPool(pool_name=name, pool_size=self.pool_size, **config)
+        except mariadb.Error as e:
+            if "Unknown database" not in str(e):
+                raise
+            logger.info(f"データベース '{self.database}' が存在しません。作成します...")
+            self.create_database()
+            self._pool = mariadb.ConnectionPool(pool_name=name, pool_size=self.pool_size, **config)
+        logger.info(f"MariaDBの接続プールを作成しました（データベース: {self.database}、 接続数: {self.pool_size}）")
+
+    def create_database(self):
+        """データベースを作成する"""
+        temp_conn = mariadb.connect(**self.db_config)
+        try:
+            temp_cursor = temp_conn.cursor()
+            temp_cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+            temp_conn.commit()
+            temp_cursor.close()
+            logger.info(f"データベース '{self.database}' を作成しました")
+        finally:
+            temp_conn.close()
+
+    def _check_thread(self):
+        """イベントループのスレッドから同期で使われていれば警告する（1回だけ）"""
+        if self._warned_loop:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._warned_loop = True
+        logger.warning(
+            "イベントループのスレッドからDBを同期で使っています。待っている間はループが止まるので、"
+            "AsyncDatabase（modules.database.asyncdb）を使ってください"
+        )
+
+    def acquire(self) -> mariadb.Connection:
+        """接続を借りる（返すときはrelease、空きが無ければ呼んだスレッドで待つ）"""
+        self._check_thread()
+        start = time.monotonic()
+        with self._cond:
+            if self._pool is None:
+                self._create_pool()
+
+            # 空きが出るまで待つ（sleepで待たず、返却されたら起こされる）
+            deadline = start + self.timeout
+            while self._in_use >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"空きの接続がありません（{self.timeout}秒待ちました）")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self._in_use)
+
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            self._check(conn)
+        except Exception:
+            # 繋ぎ直せなかった接続もプールに返す（返さないとプールの接続が減っていく）
+            self.release(conn)
+            raise
+
+        wait = time.monotonic() - start
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return conn
+
+    def _check(self, conn: mariadb.Connection):
+        """貸し出す前に接続が生きているか確認する（切れていれば繋ぎ直す）"""
+        try:
+            conn.ping()
+        except mariadb.Error:
+            self.health_failures += 1
+            logger.warning("切れていた接続を繋ぎ直します")
+            conn.reconnect()
+
+    def release(self, conn: mariadb.Connection):
+        """接続をプールに返す"""
+        if conn is not None:
+            try:
+                # 途中のトランザクションは取り消してからプールに戻す
+                conn.rollback()
+            except mariadb.Error as e:
+                logger.debug(f"ロールバックに失敗しました: {e}")
+            try:
+                conn.close()
+            except mariadb.Error as e:
+                logger.debug(f"接続の返却に失敗しました: {e}")
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """プールから接続を借りる"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def backoff(self, attempt: int):
+        """再試行の前に待つ（呼んだスレッドを止めるので、ループからはAsyncDatabase経由で使う）"""
+        self._check_thread()
+        time.sleep(DB_RETRY_BACKOFF * (2 ** (attempt - 1)) * (1 + random.random()))
+
+    def stats(self) -> dict:
+        with self._cond:
+            in_use = self._in_use
+        return {
+            "size": self.pool_size,
+            "in_use": in_use,
+            "utilization": in_use / self.pool_size if self.pool_size else 0.0,
+            "peak_in_use": self.peak_in_use,
+            "checkouts": self.checkouts,
+            "avg_wait": self.total_wait / self.checkouts if self.checkouts else 0.0,
+            "max_wait": self.max_wait,
+            "timeouts": self.timeouts,
+            "health_failures": self.health_failures,
+        }
+
+    def close(self):
+        with self._cond:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+                logger.info("データベースの接続プールを閉じました")
+
+
+_pools: dict[tuple, DatabasePool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(user, password, host, port, database) -> DatabasePool:
+    """接続先ごとに1つの共有プールを返す"""
+    key = (user, host, int(port), database)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = DatabasePool(user, password, host, port, database)
+        return pool
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        return {f"{key[1]}:{key[2]}/{key[3]}": pool.stats() for key, pool in _pools.items()}
+
+def close_pools():
+    """終了時にすべてのプールを閉じる"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
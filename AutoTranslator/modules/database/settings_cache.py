@@ -0,0 +1,157 @@
+import threading
+import re
+import os
+
+from collections import OrderedDict
+
+# 覚えておく行数
+SETTINGS_CACHE_ROWS = int(os.getenv("SETTINGS_CACHE_ROWS", 10000))
+
+
+def column_type(sql_type: str):
+    """SQLの型からPythonの型を決める"""
+    sql_type = sql_type.upper()
+    if re.search(r"\b(REAL|FLOAT|DOUBLE|DECIMAL)\b", sql_type):
+        return float
+    if "INT" in sql_type:
+        return int
+    return str
+
+
+class SettingsCache:
+    """設定テーブルの行をまるごと覚えておくキャッシュ（書き込みはsave_settingから反映する）"""
+
+    def __init__(self, max_rows: int = SETTINGS_CACHE_ROWS):
+        self.max_rows = max_rows
+        # テーブル名 -> {カラム名: 型}
+        self.schemas: dict[str, dict[str, type]] = {}
+        # (データベース名, テーブル名, ID) -> 行
+        self._rows: OrderedDict[tuple[str, str, int], dict] = OrderedDict()
+        self._lock = threading.Lock()
+        # 無効化されたときに呼ばれる関数 (database, table, id)
+        self._listeners = []
+        # 書き込み・無効化のたびに増える番号（読み込み中に変わった行をキャッシュしないため）
+        self._generation = 0
+        # キー -> 最後に書き込み・無効化したときの番号（覚えていない行も含む）
+        self._written: OrderedDict[tuple[str, str, int], int] = OrderedDict()
+        # これより前に始めた読み込みはキャッシュしない（_writtenから消した分とまとめて無効化した分）
+        self._floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def register(self, table_name: str, columns: list[tuple[str, str]]):
+        """設定リストからテーブルの型を登録する（登録したテーブルだけキャッシュする）"""
+        self.schemas[table_name] = {name: column_type(sql_type) for name, sql_type in columns}
+
+    def cacheable(self, table_name: str, name: str = None) -> bool:
+        schema = self.schemas.get(table_name)
+        return schema is not None and (name is None or name in schema)
+
+    def columns(self, table_name: str) -> list[str]:
+        return list(self.schemas[table_name])
+
+    def coerce(self, table_name: str, values: dict) -> dict:
+        """値を設定リストの型に揃える"""
+        schema = self.schemas[table_name]
+        return {
+            name: value if value is None or name not in schema else schema[name](value)
+            for name, value in values.items()
+        }
+
+    def get(self, database: str, table_name: str, primary_id: int):
+        key = (database, table_name, primary_id)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end(key)
+            self.hits += 1
+            return row
+
+    def begin_load(self) -> int:
+        """DBから読み込む前に呼ぶ（返した番号をputに渡す）"""
+        with self._lock:
+            return self._generation
+
+    def _touch(self, key: tuple[str, str, int]):
+        # _lockの中で呼ぶ
+        self._generation += 1
+        self._written[key] = self._generation
+        self._written.move_to_end(key)
+        while len(self._written) > self.max_rows:
+            _, generation = self._written.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def stale(self, key: tuple[str, str, int], generation: int) -> bool:
+        """generationの後に書き込み・無効化されたか（_lockの中で呼ぶ）"""
+        return generation < self._floor or self._written.get(key, 0) > generation
+
+    def put(self, database: str, table_name: str, primary_id: int, row: dict, generation: int = None) -> dict:
+        """読み込んだ行を覚える（generationの後に書き込まれていれば古いので覚えない）"""
+        key = (database, table_name, primary_id)
+        row = self.coerce(table_name, row)
+        with self._lock:
+            if generation is not None and self.stale(key, generation):
+                return row
+            self._rows[key] = row
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+        return row
+
+    def update(self, database: str, table_name: str, primary_id: int, values: dict):
+        """保存した値を覚えている行に反映する（覚えていなければ何もしない）"""
+        key = (database, table_name, primary_id)
+        values = self.coerce(table_name, values)
+        with self._lock:
+            self._touch(key)
+            row = self._rows.get(key)
+            if row is not None:
+                self._rows[key] = {**row, **values}
+
+    def invalidate(self, database: str = None, table_name: str = None, primary_id: int = None):
+        """覚えている行を捨てる（指定しなければすべて）"""
+        with self._lock:
+            keys = [
+                key for key in self._rows
+                if (database is None or key[0] == database)
+                and (table_name is None or key[1] == table_name)
+                and (primary_id is None or key[2] == primary_id)
+            ]
+            for key in keys:
+                del self._rows[key]
+            self.invalidations += len(keys)
+
+            if None in (database, table_name, primary_id):
+                # まとめて無効化したときは読み込み中のものをすべてキャッシュしない
+                self._generation += 1
+                self._floor = self._generation
+            else:
+                self._touch((database, table_name, primary_id))
+
+        for listener in list(self._listeners):
+            listener(database, table_name, primary_id)
+
+    def on_invalidate(self, listener):
+        """無効化されたときに呼ばれる関数を登録する"""
+        self._listeners.append(listener)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "rows": len(self._rows),
+        }
+
+
+# 共有のキャッシュ
+settings_cache = SettingsCache()
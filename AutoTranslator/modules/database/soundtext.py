@@ -1,6 +1,7 @@
 import mariadb
 import dotenv
 import logging
+import threading
 import time
 import sys
 import os
@@ -9,6 +10,8 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(parent_dir)
 
 import log
+from modules.database.pool import DatabasePool, get_pool
+from modules.database.consolidate import list_legacy_tables, migrate_guild, WORD_MAX_LENGTH
 
 class SoundtextManager:
     def __init__(self, user, password, host, port, database, max_retries=3):
@@ -23,41 +26,24 @@ class SoundtextManager:
         }
         self.database = database
         self.max_retries = max_retries
-        self.conn = None
-        self.cursor = None
+        self.pool: DatabasePool = None
+        # 全サーバー共通のテーブル
+        self.table_name = "soundtext"
+        # 統合テーブルを準備済みか / まだ移行していないサーバーごとのテーブル
+        self._prepared = False
+        self._legacy: set[int] = set()
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
         self.connect_db()
 
     def connect_db(self):
-        """データベースに接続（存在しなければ作成)"""
-        try:
-            # まず通常の接続を試す
-            self.conn = mariadb.connect(**self.db_config, database=self.database)
-            self.cursor = self.conn.cursor()
-            self.logger.info(f"MariaDBに接続しました（データベース: {self.database}）")
-
-        except mariadb.Error as e:
-            if "Unknown database" in str(e):
-                self.logger.info("データベースを生成中")
-                self.create_database()
-            else:
-                self.logger.error("データベース接続エラー: %s", e)
-                self.conn = None
-                self.cursor = None
+        """共有の接続プールを取得（データベースが存在しなければ最初の接続時に作成）"""
+        self.pool = get_pool(**self.db_config, database=self.database)
 
     def create_database(self):
-        """データベースを作成して再接続"""
+        """データベースを作成"""
         try:
-            # データベースなしで接続（データベース作成のため）
-            temp_conn = mariadb.connect(**self.db_config)
-            temp_cursor = temp_conn.cursor()
-            temp_cursor.execute(f"CREATE DATABASE {self.database}")
-            temp_conn.commit()
-            temp_cursor.close()
-            temp_conn.close()
-            self.logger.info(f"データベース '{self.database}' を作成しました")
-
-            # 再接続
-            self.connect_db()
+            self.pool.create_database()
         except mariadb.Error as e:
             self.logger.error(f"データベース作成エラー: {e}")
 
@@ -65,27 +51,26 @@ class SoundtextManager:
         """SQLクエリを実行し、必要に応じて結果を取得"""
         for attempt in range(1, self.max_retries + 1):
             try:
-                if not self.conn or not self.cursor:
-                    self.logger.info(f"データベースに再接続中... ({attempt}/{self.max_retries})")
-                    self.connect_db()
-
-                if not self.conn or not self.cursor:
-                    raise mariadb.OperationalError("データベースに接続できません")
-
-                self.cursor.execute(query, params or ())
-                self.conn.commit()
-
-                # `SHOW` クエリや `SELECT` の場合のみ fetch する
-                if fetch:
-                    return self.cursor.fetchall()
-
-                return None
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(query, params or ())
+
+                        # `SHOW` クエリや `SELECT` の場合のみ fetch する（読み取りはコミットしない）
+                        if fetch:
+                            result = cursor.fetchall()
+                        else:
+                            # 成功したことが分かるようにTrueを返す
+                            result = True
+                            conn.commit()
+                    finally:
+                        cursor.close()
+                return result
 
             except mariadb.OperationalError as e:
-                self.logger.error("データベース接続エラー: %s", e)
-                self.conn = None
-                self.cursor = None
-                time.sleep(1)
+                self.logger.error(f"接続エラー: {e} ({attempt}/{self.max_retries})")
+                if attempt < self.max_retries:
+                    self.pool.backoff(attempt)
             except mariadb.Error as e:
                 self.logger.error(f"クエリエラー: {e} \n クエリ: {query}")
                 return None
@@ -99,69 +84,118 @@ class SoundtextManager:
         result = self.execute_query(f"SHOW TABLES LIKE '{table_name}'", fetch=True)
         return bool(result)
     
-    def create_table(self, server_id, columns):
-        """""テーブルを作成"""
-        self.logger.debug (f"Creating table '{server_id}'...")
-        query = f"""
-            CREATE TABLE `{server_id}` (
-                {", ".join([f"{col[0]} {col[1]}" for col in columns])   }
-            )
-        """
-        
-        if self.execute_query(query):
-            self.logger.info(f"テーブル '{server_id}' を作成しました")
-    
-    def init_server_dict(self, server_id):
-        """サーバー用の辞書テーブルを準備"""
-        self.logger.debug(f"Initializing dictionary table for server '{server_id}'...")
-        if not self.table_exists(server_id):
-            self.create_table(server_id, soundtext_settings)
-
+    def prepare(self) -> bool:
+        """統合テーブルを作成し、残っているサーバーごとのテーブルを覚える（成功するまで呼ぶたびに試す）"""
+        with self._lock:
+            if self._prepared:
+                return True
+            created = self.execute_query(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    {", ".join([f"{col[0]} {col[1]}" for col in soundtext_settings])},
+                    UNIQUE KEY guild_word (guild_id, word),
+                    KEY user_idx (user_id)
+                )
+            """)
+            legacy = list_legacy_tables(self) if created else None
+            if legacy is None:
+                # DBに繋がらないときは移行すべきテーブルが分からないので、次に呼ばれたときにやり直す
+                self.logger.error(f"{self.table_name}: 統合テーブルを準備できませんでした")
+                return False
+            self._legacy = legacy
+            self._prepared = True
+            if self._legacy:
+                self.logger.info(f"未移行のサーバーごとのテーブル: {len(self._legacy)}件")
+            return True
+
+    def init_server_dict(self, server_id) -> bool:
+        """サーバー用の辞書を準備（サーバーごとのテーブルが残っていれば先に移行する、使えなければFalse）"""
+        if not self.prepare():
+            return False
+        if int(server_id) in self._legacy:
+            return self.migrate_server(int(server_id)) is not None
+        return True
+
+    def migrate_server(self, server_id: int, pause: float = 0):
+        """サーバーごとのテーブルを統合テーブルへ移行する"""
+        # 同じサーバーを同時に移行しない（移行中に読み込んだ場合は終わるまで待つ）
+        with self._migrate_lock:
+            if server_id not in self._legacy:
+                return 0
+            copied = migrate_guild(self, self.table_name, server_id, LEGACY_COLUMNS, pause=pause)
+            if copied is not None:
+                with self._lock:
+                    self._legacy.discard(server_id)
+            return copied
+
+    def migrate_all(self, pause: float = 0) -> dict:
+        """残っているすべてのサーバーごとのテーブルを移行する（botを止めずに実行できる、準備に失敗したらNone）"""
+        if not self.prepare():
+            return None
+        result = {"migrated": 0, "rows": 0, "failed": 0}
+        for server_id in sorted(self._legacy):
+            copied = self.migrate_server(server_id, pause=pause)
+            if copied is None:
+                result["failed"] += 1
+            else:
+                result["migrated"] += 1
+                result["rows"] += copied
+        return result
 
     def get_dict(self, server_id):
         """サーバー用の辞書を取得"""
         self.logger.debug(f"Getting dictionary for server '{server_id}'...")
-        self.init_server_dict(server_id)
-        
-        query = f"SELECT * FROM `{server_id}`"
+        if not self.init_server_dict(server_id):
+            # 移行前の単語が含まれない不完全な辞書は返さない
+            return None
 
-        result = self.execute_query(query, fetch=True)
+        # 列の並びはサーバーごとのテーブルと同じ
+        query = f"SELECT {', '.join(['id', *LEGACY_COLUMNS])} FROM {self.table_name} WHERE guild_id = %s ORDER BY id"
+
+        result = self.execute_query(query, [server_id], fetch=True)
 
         return result if result else None
     
     def save_dict(self, server_id, settings):
         """サーバー用の辞書を保存"""
         self.logger.debug(f"Saving dictionary for server '{server_id}'...")
-        self.init_server_dict(server_id)
+        # 移行に失敗していても統合テーブルへの保存はできる（移行では後から保存したものが優先される）
+        if not self.prepare():
+            return None
+        if len(str(settings.get("word", ""))) > WORD_MAX_LENGTH:
+            # 切り詰めて保存すると別の単語になるので保存しない
+            self.logger.error(f"{WORD_MAX_LENGTH} 文字を超える単語は保存できません")
+            return None
 
         query = f"""
-            INSERT INTO `{server_id}` ({", ".join(settings.keys())})
-            VALUES ({", ".join(["%s"] * len(settings))})
+            INSERT INTO {self.table_name} (guild_id, {", ".join(settings.keys())})
+            VALUES (%s, {", ".join(["%s"] * len(settings))})
             ON DUPLICATE KEY UPDATE {", ".join([f"{k}=%s" for k in settings.keys()])} 
         """
-        params = list(settings.values()) + list(settings.values())
+        params = [server_id] + list(settings.values()) + list(settings.values())
 
-        self.execute_query(query, params)
+        return self.execute_query(query, params)
 
     def close(self):
-        """データベース接続を閉じる"""
-        if self.conn:
-            self.cursor.close()
-            self.conn.close()
-            print("データベース接続を閉じました")
+        """プールは他のマネージャーと共有しているので参照だけ外す（閉じるのはclose_pools）"""
+        self.pool = None
 
 
 # ==============================
 # 設定リスト
 # ==============================
+# 全サーバー共通のテーブル（(guild_id, word)で一意）
 soundtext_settings = [
-    ("id", "INTEGER AUTO_INCREMENT PRIMARY KEY"),
-    ("word", "TEXT NOT NULL UNIQUE"),
+    ("id", "BIGINT AUTO_INCREMENT PRIMARY KEY"),
+    ("guild_id", "BIGINT NOT NULL"),
+    ("word", f"VARCHAR({WORD_MAX_LENGTH}) NOT NULL"),
     ("file", "TEXT NOT NULL"),
     ("user_id", "BIGINT NOT NULL"),
     ("updated_at", "DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
 ]
 
+# サーバーごとのテーブルから移す列
+LEGACY_COLUMNS = ["word", "file", "user_id", "updated_at"]
+
 # ==============================
 # 使い方
 # ==============================
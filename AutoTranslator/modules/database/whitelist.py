@@ -8,6 +8,7 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(parent_dir)
 
 import log
+from modules.database.pool import DatabasePool, get_pool
 
 class GeneralManager:
     def __init__(self, user, password, host, port, database, max_retries=3):
@@ -22,40 +23,17 @@ class GeneralManager:
         }
         self.database = database
         self.max_retries = max_retries
-        self.conn = None
-        self.cursor = None
+        self.pool: DatabasePool = None
         self.connect_db()
 
     def connect_db(self):
-        """データベースに接続（存在しなければ作成）"""
-        try:
-            # まず通常の接続を試す
-            self.conn = mariadb.connect(**self.db_config, database=self.database)
-            self.cursor = self.conn.cursor()
-            self.logger.info(f"MariaDBに接続しました（データベース: {self.database}）")
-        except mariadb.Error as e:
-            if "Unknown database" in str(e):
-                self.logger.info(f"データベース '{self.database}' が存在しません。作成します...")
-                self.create_database()
-            else:
-                self.logger.error(f"データベース接続エラー: {e}")
-                self.conn = None
-                self.cursor = None
+        """共有の接続プールを取得（データベースが存在しなければ最初の接続時に作成）"""
+        self.pool = get_pool(**self.db_config, database=self.database)
 
     def create_database(self):
-        """データベースを作成して再接続"""
+        """データベースを作成"""
         try:
-            # データベースなしで接続（データベース作成のため）
-            temp_conn = mariadb.connect(**self.db_config)
-            temp_cursor = temp_conn.cursor()
-            temp_cursor.execute(f"CREATE DATABASE {self.database}")
-            temp_conn.commit()
-            temp_cursor.close()
-            temp_conn.close()
-            self.logger.info(f"データベース '{self.database}' を作成しました")
-
-            # 再接続
-            self.connect_db()
+            self.pool.create_database()
         except mariadb.Error as e:
             self.logger.error(f"データベース作成エラー: {e}")
 
@@ -63,32 +41,30 @@ class GeneralManager:
         """SQLクエリを実行し、必要に応じて結果を取得"""
         for attempt in range(1, self.max_retries + 1):
             try:
-                if not self.conn or not self.cursor:
-                    self.logger.info(f"データベースに再接続中... ({attempt}/{self.max_retries})")
-                    self.connect_db()
-
-                if not self.conn or not self.cursor:
-                    raise mariadb.OperationalError("データベースに接続できません")
-
-                self.cursor.execute(query, params or ())
-                self.conn.commit()
-
-                # `SHOW` クエリや `SELECT` の場合のみ fetch する
-                if fetch:
-                    return self.cursor.fetchall()
-
-                return None
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(query, params or ())
+
+                        # `SHOW` クエリや `SELECT` の場合のみ fetch する（読み取りはコミットしない）
+                        if fetch:
+                            result = cursor.fetchall()
+                        else:
+                            result = None
+                            conn.commit()
+                    finally:
+                        cursor.close()
+                return result
 
             except mariadb.OperationalError as e:
-                self.logger.error(f"接続エラー: {e}")
-                self.conn = None
-                self.cursor = None
-                time.sleep(1)
+                self.logger.error(f"接続エラー: {e} ({attempt}/{self.max_retries})")
+                if attempt < self.max_retries:
+                    self.pool.backoff(attempt)
             except mariadb.Error as e:
-                self.logger.exception(f"SQLエラー: {e}")
+                self.logger.error(f"クエリエラー: {e} \n クエリ: {query}")
                 return None
 
-        print("リトライ回数を超過しました。クエリ実行を中止します。")
+        self.logger.error("リトライ回数を超過しました。クエリ実行を中止します。")
         return None
 
     def table_exists(self, table_name: str) -> bool:
@@ -169,11 +145,8 @@ class GeneralManager:
                 self.execute_query(f"ALTER TABLE {table_name} ADD COLUMN {column} {new_col_type}")
 
     def close(self):
-        """データベース接続を閉じる"""
-        if self.conn:
-            self.cursor.close()
-            self.conn.close()
-            self.logger.info("データベース接続を閉じました")
+        """プールは他のマネージャーと共有しているので参照だけ外す（閉じるのはclose_pools）"""
+        self.pool = None
 
 
 # ==============================
@@ -0,0 +1,139 @@
+import functools
+import langdetect
+import os
+
+from langdetect import DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 結果を固定するためのシード（langdetectは既定だと毎回結果が変わる）
+DetectorFactory.seed = 0
+
+# プロファイル判定で採用する最低の確からしさ
+DETECT_THRESHOLD = float(os.getenv("DETECT_THRESHOLD", 0.7))
+# プロファイル判定のメモ化件数
+DETECT_CACHE_SIZE = int(os.getenv("DETECT_CACHE_SIZE", 4096))
+# 英字だけの文を英語と決めつける最低の単語数（gg・lol・okなどの短い文はプロファイルで判定する）
+DETECT_ASCII_MIN_WORDS = int(os.getenv("DETECT_ASCII_MIN_WORDS", 3))
+
+
+def _script_of(char: str) -> str:
+    """1文字の文字種を返す"""
+    code = ord(char)
+    if 0x3040 <= code <= 0x30FF or 0x31F0 <= code <= 0x31FF or 0xFF66 <= code <= 0xFF9F:
+        return "kana"
+    if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0xF900 <= code <= 0xFAFF:
+        return "han"
+    if 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF or 0x3130 <= code <= 0x318F:
+        return "hangul"
+    if char.isascii():
+        return "ascii" if char.isalpha() else None
+    if char.isalpha():
+        return "other"
+    return None
+
+
+def detect_script(text: str):
+    """文字種だけで判定できる場合は言語コードを返す（判定できなければNone）"""
+    counts = {"kana": 0, "han": 0, "hangul": 0, "ascii": 0, "other": 0}
+    words = 0
+    previous = None
+    for char in text:
+        script = _script_of(char)
+        if script:
+            counts[script] += 1
+        if script == "ascii" and previous != "ascii":
+            words += 1
+        previous = script
+
+    # ひらがな・カタカナがあれば日本語
+    if counts["kana"]:
+        return "ja"
+    if counts["hangul"] and counts["hangul"] >= counts["han"]:
+        return "ko"
+    # 漢字だけ（ハングルなし）の短い文は日本語（了解・草など、プロファイルだと中国語や韓国語になる）
+    if counts["han"] and not counts["hangul"]:
+        return "ja"
+    # 英字のみ（記号・数字は無視）で単語がいくつかあれば英語
+    if words >= DETECT_ASCII_MIN_WORDS and not (counts["han"] or counts["hangul"] or counts["other"]):
+        return "en"
+    return None
+
+
+@functools.lru_cache(maxsize=DETECT_CACHE_SIZE)
+def _detect_profile(text: str):
+    """langdetectのプロファイルで判定する（結果はメモ化）"""
+    try:
+        candidates = langdetect.detect_langs(text)
+    except LangDetectException:
+        return None, 0.0
+
+    if not candidates:
+        return None, 0.0
+    best = candidates[0]
+    return best.lang, best.prob
+
+
+def detect_language(text: str, threshold: float = DETECT_THRESHOLD):
+    """文字種 → プロファイルの順に言語を判定する（判定できなければNone）"""
+    text = text.strip()
+    if not text:
+        return None
+
+    lang = detect_script(text)
+    if lang:
+        return lang
+
+    lang, prob = _detect_profile(text)
+    if prob < threshold:
+        return None
+    # 英字だけの短い文はプロファイルだとgg→tl、lol→esのようになるので、日本語・英語以外は判定しない
+    if text.isascii() and lang not in ("ja", "en"):
+        return None
+    return lang
+
+
+def detect_stats() -> dict:
+    """プロファイル判定のメモ化の統計情報"""
+    info = _detect_profile.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+# ==============================
+# ベンチマーク
+# ==============================
+# AutoTranslatorディレクトリで `python -m modules.detect` を実行
+if __name__ == "__main__":
+    import time
+
+    corpus = [
+        "おはよう", "gg", "lol", "こんにちは！今日もよろしくね", "nice to meet you",
+        "草", "それな", "wwww", "ありがとう！", "thanks!", "I'll be there in 5 min",
+        "今日の配信見た？", "brb", "了解です", "what time is the event?",
+        "明日は雨らしい", "ok", "すごい！", "good night everyone", "おやすみ〜",
+        "VCに入るね", "can you hear me?", "マイク入ってないよ", "lmao that was close",
+        "안녕하세요", "你好", "Bonjour à tous", "GG WP", "それってどういうこと？", "see you tomorrow",
+    ] * 100
+
+    def bench(name, func):
+        start = time.perf_counter()
+        results = []
+        for sentence in corpus:
+            try:
+                results.append(func(sentence))
+            except LangDetectException:
+                results.append(None)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10} {elapsed*1000:9.2f} ms  ({elapsed/len(corpus)*1e6:8.2f} us/msg)")
+        return results
+
+    DetectorFactory.seed = None
+    baseline = bench("langdetect", langdetect.detect)
+    DetectorFactory.seed = 0
+    tiered = bench("tiered", detect_language)
+
+    agree = sum(1 for a, b in zip(baseline, tiered) if a == b)
+    print(f"agreement: {agree}/{len(corpus)}  memo: {detect_stats()}")
@@ -0,0 +1,229 @@
+import asyncio
+import datetime
+import time
+import os
+
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# DeepLの月間文字数（全体）
+DEEPL_MONTHLY_CHARS = int(os.getenv("DEEPL_MONTHLY_CHARS", 500000))
+# 1サーバーあたりの月間文字数（サーバー設定が無い場合）
+TRANSLATE_GUILD_MONTHLY_CHARS = int(os.getenv("TRANSLATE_GUILD_MONTHLY_CHARS", 100000))
+# 全体のバケット（1秒あたりの文字数 / 最大量）
+TRANSLATE_GLOBAL_RATE = float(os.getenv("TRANSLATE_GLOBAL_RATE", 200))
+TRANSLATE_GLOBAL_BURST = float(os.getenv("TRANSLATE_GLOBAL_BURST", 10000))
+# サーバーごとのバケット（1秒あたりの文字数 / 最大量）
+TRANSLATE_GUILD_RATE = float(os.getenv("TRANSLATE_GUILD_RATE", 50))
+TRANSLATE_GUILD_BURST = float(os.getenv("TRANSLATE_GUILD_BURST", 2000))
+# 残りがこの割合を下回ったら「残りわずか」とする
+TRANSLATE_LOW_RATIO = float(os.getenv("TRANSLATE_LOW_RATIO", 0.1))
+
+# 全体の使用量を保存するID
+GLOBAL_ID = 0
+
+
+class QuotaExceeded(Exception):
+    """翻訳の文字数制限に達した"""
+    def __init__(self, guild_id: int, reason: str):
+        super().__init__(reason)
+        self.guild_id = guild_id
+        self.reason = reason
+
+
+def current_period() -> int:
+    """集計期間（YYYYMM）"""
+    now = datetime.datetime.now()
+    return now.year * 100 + now.month
+
+
+class TokenBucket:
+    """文字数ベースのトークンバケット"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def level(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def can_consume(self, amount: float) -> bool:
+        self._refill()
+        # バケットより大きいものは満タンなら通す
+        return self.tokens >= min(amount, self.capacity)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Usage:
+    """月間の使用量"""
+
+    def __init__(self, limit: int, used: int = 0, period: int = 0):
+        self.limit = limit
+        self.used = used
+        self.period = period or current_period()
+
+    def roll(self):
+        """月が変わったら使用量をリセット"""
+        period = current_period()
+        if period != self.period:
+            self.period = period
+            self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+
+class QuotaLimiter:
+    """サーバーごと + 全体のトークンバケットと月間の文字数を管理する"""
+
+    def __init__(self, db=None, table_name: str = "translate_settings"):
+        self.db = db
+        self.table_name = table_name
+
+        self.global_bucket = TokenBucket(TRANSLATE_GLOBAL_RATE, TRANSLATE_GLOBAL_BURST)
+        self.guild_buckets: dict[int, TokenBucket] = {}
+        self.usage: dict[int, Usage] = {}
+        self._dirty: set[int] = set()
+        self._loading: dict[int, asyncio.Task] = {}
+
+        self.denied = 0
+
+    # ------------------------------
+    # DBとの同期（スレッド上で実行する）
+    # ------------------------------
+    def _load_blocking(self, primary_id: int, default_limit: int) -> Usage:
+        if not self.db:
+            return Usage(default_limit)
+
+        limit = self.db.get_setting(self.table_name, primary_id, "char_limit")
+        used = self.db.get_setting(self.table_name, primary_id, "chars_used") or 0
+        period = self.db.get_setting(self.table_name, primary_id, "period") or 0
+
+        usage = Usage(limit if limit is not None else default_limit, used, period)
+        usage.roll()
+        return usage
+
+    def flush(self):
+        """変更のあった使用量をDBへ保存"""
+        if not self.db:
+            self._dirty.clear()
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        for primary_id in dirty:
+            usage = self.usage.get(primary_id)
+            if usage:
+                self.db.save_setting(self.table_name, primary_id, {
+                    "chars_used": usage.used,
+                    "period": usage.period,
+                })
+        if dirty:
+            logger.debug(f"翻訳の使用量を保存しました: {len(dirty)}件")
+
+    async def ensure_loaded(self, guild_id: int):
+        """サーバー（と全体）の使用量をDBから読み込む"""
+        for primary_id, default_limit in ((GLOBAL_ID, DEEPL_MONTHLY_CHARS), (guild_id, TRANSLATE_GUILD_MONTHLY_CHARS)):
+            if primary_id is None or primary_id in self.usage:
+                continue
+
+            task = self._loading.get(primary_id)
+            if task is None:
+                task = asyncio.create_task(asyncio.to_thread(self._load_blocking, primary_id, default_limit))
+                self._loading[primary_id] = task
+            try:
+                usage = await asyncio.shield(task)
+            except Exception as e:
+                logger.error(f"翻訳の使用量を読み込めませんでした: {e}")
+                usage = Usage(default_limit)
+            finally:
+                self._loading.pop(primary_id, None)
+            self.usage.setdefault(primary_id, usage)
+
+    # ------------------------------
+    # 制限
+    # ------------------------------
+    def _guild_bucket(self, guild_id: int) -> TokenBucket:
+        bucket = self.guild_buckets.get(guild_id)
+        if bucket is None:
+            bucket = self.guild_buckets[guild_id] = TokenBucket(TRANSLATE_GUILD_RATE, TRANSLATE_GUILD_BURST)
+        return bucket
+
+    def _usages(self, guild_id: int) -> list[Usage]:
+        usages = []
+        for primary_id in (GLOBAL_ID, guild_id):
+            usage = self.usage.get(primary_id)
+            if usage:
+                usage.roll()
+                usages.append(usage)
+        return usages
+
+    def try_consume(self, guild_id: int, chars: int):
+        """文字数を消費する（制限に達していればQuotaExceeded）"""
+        for usage in self._usages(guild_id):
+            if usage.used + chars > usage.limit:
+                self.denied += 1
+                raise QuotaExceeded(guild_id, "monthly")
+
+        buckets = [self.global_bucket]
+        if guild_id is not None:
+            buckets.append(self._guild_bucket(guild_id))
+        if not all(bucket.can_consume(chars) for bucket in buckets):
+            self.denied += 1
+            raise QuotaExceeded(guild_id, "rate")
+
+        for bucket in buckets:
+            bucket.consume(chars)
+        for primary_id in (GLOBAL_ID, guild_id):
+            usage = self.usage.get(primary_id)
+            if usage:
+                usage.used += chars
+                self._dirty.add(primary_id)
+
+    def refund(self, guild_id: int, chars: int):
+        """翻訳できなかった分の文字数を戻す"""
+        self.global_bucket.refund(chars)
+        if guild_id is not None:
+            self._guild_bucket(guild_id).refund(chars)
+        for primary_id in (GLOBAL_ID, guild_id):
+            usage = self.usage.get(primary_id)
+            if usage:
+                usage.used = max(0, usage.used - chars)
+                self._dirty.add(primary_id)
+
+    def is_low(self, guild_id: int) -> bool:
+        """残りの文字数がわずかか"""
+        return any(usage.remaining < usage.limit * TRANSLATE_LOW_RATIO for usage in self._usages(guild_id))
+
+    def report(self, guild_id: int) -> dict:
+        """使用量のレポート"""
+        guild = self.usage.get(guild_id)
+        total = self.usage.get(GLOBAL_ID)
+        return {
+            "period": current_period(),
+            "guild_used": guild.used if guild else 0,
+            "guild_limit": guild.limit if guild else TRANSLATE_GUILD_MONTHLY_CHARS,
+            "global_used": total.used if total else 0,
+            "global_limit": total.limit if total else DEEPL_MONTHLY_CHARS,
+            "guild_bucket": self._guild_bucket(guild_id).level if guild_id is not None else None,
+            "global_bucket": self.global_bucket.level,
+            "denied": self.denied,
+        }
@@ -0,0 +1,89 @@
+import re
+
+from xml.sax.saxutils import escape, unescape
+
+# 翻訳しない部分（コードブロック、URL、カスタム絵文字、メンション、タイムスタンプ、絵文字）
+_UNTRANSLATABLE = re.compile(
+    r"```.*?```"                       # コードブロック
+    r"|`[^`\n]+`"                      # インラインコード
+    r"|<?https?://[^\s>]+>?"           # URL
+    r"|<a?:\w+:\d+>"                   # カスタム絵文字
+    r"|<(?:@[!&]?|#)\d+>"              # メンション・チャンネル
+    r"|</[\w ]+:\d+>"                  # スラッシュコマンド
+    r"|<t:-?\d+(?::[tTdDfFR])?>"       # タイムスタンプ
+    r"|[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D\U000E0020-\U000E007F]+",  # 絵文字
+    re.DOTALL
+)
+
+# DeepL（tag_handling="xml"）がそのまま残すプレースホルダー
+_PLACEHOLDER = re.compile(r'<x\s+i="(\d+)"\s*/>')
+
+
+class MaskedText:
+    """翻訳しない部分をプレースホルダーに置き換えたテキスト"""
+
+    def __init__(self, original: str, masked: str, tokens: list[str], plain: str):
+        self.original = original
+        self.masked = masked    # DeepLへ送るテキスト
+        self.tokens = tokens    # 置き換えた部分
+        self.plain = plain      # 言語判定に使うテキスト（置き換えた部分を除く）
+
+    @property
+    def translatable(self) -> bool:
+        """翻訳する文字が残っているか"""
+        return any(char.isalpha() for char in self.plain)
+
+    @property
+    def options(self) -> dict:
+        """DeepLへ渡すオプション"""
+        return {"tag_handling": "xml"} if self.tokens else {}
+
+    def restore(self, translated: str) -> str:
+        """翻訳結果のプレースホルダーを元に戻す"""
+        if not self.tokens:
+            return translated
+
+        result = []
+        used = set()
+        position = 0
+        for match in _PLACEHOLDER.finditer(translated):
+            result.append(unescape(translated[position:match.start()]))
+            index = int(match.group(1))
+            if index < len(self.tokens):
+                result.append(self.tokens[index])
+                used.add(index)
+            position = match.end()
+        result.append(unescape(translated[position:]))
+
+        # 翻訳で消えてしまったものは末尾に付け直す
+        missing = [token for i, token in enumerate(self.tokens) if i not in used]
+        if missing:
+            result.append(" " + " ".join(missing))
+
+        return "".join(result)
+
+
+def mask_text(text: str) -> MaskedText:
+    """メッセージから翻訳しない部分を取り除く"""
+    tokens = []
+    masked = []
+    plain = []
+    position = 0
+
+    for match in _UNTRANSLATABLE.finditer(text):
+        before = text[position:match.start()]
+        masked.append(escape(before))
+        plain.append(before)
+        masked.append(f'<x i="{len(tokens)}"/>')
+        plain.append(" ")
+        tokens.append(match.group(0))
+        position = match.end()
+
+    rest = text[position:]
+    plain.append(rest)
+
+    if not tokens:
+        return MaskedText(text, text, [], text)
+
+    masked.append(escape(rest))
+    return MaskedText(text, "".join(masked), tokens, "".join(plain).strip())
@@ -0,0 +1,239 @@
+import asyncio
+import sqlite3
+import time
+import unicodedata
+import os
+import re
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# メモリキャッシュの上限（バイト）
+CACHE_MEMORY_BYTES = int(os.getenv("TRANSLATE_CACHE_MEMORY_BYTES", 4 * 1024 * 1024))
+# ディスクキャッシュの上限（件数）
+CACHE_DISK_ROWS = int(os.getenv("TRANSLATE_CACHE_DISK_ROWS", 200000))
+# キャッシュの有効期限（秒）
+CACHE_TTL = int(os.getenv("TRANSLATE_CACHE_TTL", 30 * 24 * 60 * 60))
+# ディスクキャッシュのパス
+CACHE_PATH = os.getenv("TRANSLATE_CACHE_PATH", "./translate_cache.db")
+# 何件書き込むごとにディスクキャッシュを整理するか
+TRIM_INTERVAL = 100
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュのキーに使うためにテキストを正規化する"""
+    text = unicodedata.normalize("NFKC", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class TranslationCache:
+    """メモリ(LRU) + SQLiteの2段構成の翻訳キャッシュ"""
+
+    def __init__(self, path: str = CACHE_PATH,
+                 memory_bytes: int = CACHE_MEMORY_BYTES,
+                 disk_rows: int = CACHE_DISK_ROWS,
+                 ttl: int = CACHE_TTL):
+        self.memory_bytes = memory_bytes
+        self.disk_rows = disk_rows
+        self.ttl = ttl
+
+        # key -> (翻訳結果, 期限, サイズ)
+        self._memory: OrderedDict[tuple, tuple[str, float, int]] = OrderedDict()
+        self._memory_size = 0
+
+        # SQLiteは専用スレッドでのみ操作する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translate_cache")
+        self._conn = None
+        self._puts_since_trim = 0
+        self.path = path
+        if path:
+            self._executor.submit(self._open_disk).result()
+
+        # 統計
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.expired = 0
+        self.saved_chars = 0
+
+    # ------------------------------
+    # ディスク（専用スレッド上で実行）
+    # ------------------------------
+    def _open_disk(self):
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (text, source, target)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_used_at ON translations (used_at)")
+            self._conn.commit()
+            logger.info(f"翻訳キャッシュを開きました: {self.path}")
+        except sqlite3.Error as e:
+            logger.error(f"翻訳キャッシュを開けませんでした: {e}")
+            self._conn = None
+
+    def _disk_get(self, key: tuple):
+        if not self._conn:
+            return None
+        now = time.time()
+        try:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM translations WHERE text = ? AND source = ? AND target = ?",
+                key
+            ).fetchone()
+            if not row:
+                return None
+            if row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM translations WHERE text = ? AND source = ? AND target = ?", key)
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE translations SET used_at = ? WHERE text = ? AND source = ? AND target = ?",
+                (now, *key)
+            )
+            self._conn.commit()
+            return row[0], row[1]
+        except sqlite3.Error as e:
+            logger.error(f"翻訳キャッシュ読み込みエラー: {e}")
+            return None
+
+    def _disk_put(self, key: tuple, result: str, created_at: float):
+        if not self._conn:
+            return 0
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, result, created_at, created_at)
+            )
+            self._conn.commit()
+
+            # 期限切れと上限超過分の削除はまとめて行う
+            self._puts_since_trim += 1
+            if self._puts_since_trim < TRIM_INTERVAL:
+                return 0
+            self._puts_since_trim = 0
+
+            removed = self._conn.execute(
+                "DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if count > self.disk_rows:
+                removed += self._conn.execute(
+                    "DELETE FROM translations WHERE rowid IN "
+                    "(SELECT rowid FROM translations ORDER BY used_at LIMIT ?)",
+                    (count - self.disk_rows,)
+                ).rowcount
+            self._conn.commit()
+            return removed
+        except sqlite3.Error as e:
+            logger.error(f"翻訳キャッシュ書き込みエラー: {e}")
+            return 0
+
+    # ------------------------------
+    # メモリ
+    # ------------------------------
+    def _memory_put(self, key: tuple, result: str, expires_at: float):
+        size = sum(len(part.encode()) for part in key) + len(result.encode())
+        if size > self.memory_bytes:
+            return
+
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_size -= old[2]
+
+        self._memory[key] = (result, expires_at, size)
+        self._memory_size += size
+
+        # 上限を超えたら古いものから削除
+        while self._memory_size > self.memory_bytes:
+            _, (_, _, evicted_size) = self._memory.popitem(last=False)
+            self._memory_size -= evicted_size
+            self.evictions += 1
+
+    # ------------------------------
+    # 公開API
+    # ------------------------------
+    @staticmethod
+    def make_key(text: str, source: str, target: str) -> tuple:
+        return (normalize_text(text), (source or "auto").lower(), target.upper())
+
+    async def get(self, text: str, source: str, target: str):
+        """キャッシュから翻訳結果を取得（なければNone）"""
+        key = self.make_key(text, source, target)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry:
+            if entry[1] >= now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.saved_chars += len(text)
+                return entry[0]
+            # 期限切れ
+            self._memory.pop(key)
+            self._memory_size -= entry[2]
+            self.expired += 1
+
+        if self._conn:
+            loop = asyncio.get_running_loop()
+            disk = await loop.run_in_executor(self._executor, self._disk_get, key)
+            if disk:
+                result, created_at = disk
+                self._memory_put(key, result, created_at + self.ttl)
+                self.disk_hits += 1
+                self.saved_chars += len(text)
+                return result
+
+        self.misses += 1
+        return None
+
+    async def put(self, text: str, source: str, target: str, result: str):
+        """翻訳結果をキャッシュへ保存"""
+        key = self.make_key(text, source, target)
+        now = time.time()
+        self._memory_put(key, result, now + self.ttl)
+
+        if self._conn:
+            loop = asyncio.get_running_loop()
+            self.disk_evictions += await loop.run_in_executor(self._executor, self._disk_put, key, result, now)
+
+    def stats(self) -> dict:
+        """キャッシュの統計情報"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "expired": self.expired,
+            "saved_chars": self.saved_chars,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+        }
+
+    def close(self):
+        """ディスクキャッシュを閉じる"""
+        def _close():
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=True)
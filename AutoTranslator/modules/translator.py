@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import threading
+import deepl
+import os
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from modules.log import get_logger
+from modules.translate_cache import TranslationCache
+from modules.ratelimit import QuotaLimiter
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# DeepLへの同時リクエスト数（スレッドプールの大きさ）
+TRANSLATE_WORKERS = int(os.getenv("TRANSLATE_WORKERS", 4))
+# 1サーバーあたりのDeepLへの同時リクエスト数（まとめ待ちのメッセージは数えない）
+TRANSLATE_GUILD_CONCURRENCY = int(os.getenv("TRANSLATE_GUILD_CONCURRENCY", 2))
+# まとめて翻訳するためにメッセージを待つ時間（ミリ秒）
+TRANSLATE_BATCH_WINDOW_MS = float(os.getenv("TRANSLATE_BATCH_WINDOW_MS", 20))
+# 1リクエストにまとめる最大メッセージ数（DeepLの上限は50）
+TRANSLATE_BATCH_MAX = int(os.getenv("TRANSLATE_BATCH_MAX", 25))
+
+
+class TranslationService:
+    """DeepLへのリクエストをイベントループ外で実行する翻訳サービス"""
+
+    def __init__(self, auth_key: str,
+                 max_workers: int = TRANSLATE_WORKERS,
+                 guild_concurrency: int = TRANSLATE_GUILD_CONCURRENCY,
+                 cache: TranslationCache = None,
+                 batch_window_ms: float = TRANSLATE_BATCH_WINDOW_MS,
+                 batch_max: int = TRANSLATE_BATCH_MAX,
+                 limiter: QuotaLimiter = None):
+        self.translator = deepl.Translator(auth_key) if auth_key else None
+        self.cache = cache
+        self.limiter = limiter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="deepl")
+        self.guild_concurrency = guild_concurrency
+        self.batch_window = batch_window_ms / 1000
+        self.batch_max = max(1, min(batch_max, 50))
+
+        # サーバーごとの同時実行数制限
+        self._guild_semaphores: dict[int, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.guild_concurrency)
+        )
+
+        # 翻訳先言語・オプションごとの待機中メッセージ: key -> [(text, guild_id, future)]
+        self._batches: dict[tuple, list[tuple[str, int, asyncio.Future]]] = {}
+        self._batch_timers: dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # 翻訳中の文: (text, source_lang, target_lang, options) -> Task（同じ文は1回だけ翻訳・消費する）
+        self._pending: dict[tuple, asyncio.Task] = {}
+
+        # キューの深さ計測用
+        self._lock = threading.Lock()
+        self.waiting = 0     # サーバーの枠が空くのを待っているメッセージ数
+        self.batched = 0     # まとめ待ちのメッセージ数
+        self.submitted = 0   # スレッドプールへ投入済みのリクエスト数（実行中を含む）
+        self.running = 0     # DeepLと通信中のリクエスト数
+        self.completed = 0
+        self.failed = 0
+        self.shared = 0      # 翻訳中の同じ文の結果を使った数
+        self.requests = 0    # DeepLへ送ったリクエスト数
+        self.batched_texts = 0  # リクエストで送ったテキスト数
+
+    @property
+    def available(self) -> bool:
+        return self.translator is not None
+
+    @property
+    def queue_depth(self) -> int:
+        """まだDeepLへ送られていないメッセージ数"""
+        return self.waiting + self.batched + (self.submitted - self.running)
+
+    def _translate_blocking(self, texts: list[str], target_lang: str, **options):
+        """スレッドプール上で実行される翻訳処理"""
+        with self._lock:
+            self.running += 1
+        try:
+            return self.translator.translate_text(texts, target_lang=target_lang, **options)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    # ------------------------------
+    # マイクロバッチ
+    # ------------------------------
+    def _enqueue(self, text: str, target_lang: str, options: dict, guild_id: int = None) -> asyncio.Future:
+        """メッセージをまとめ待ちに追加し、結果を受け取るFutureを返す"""
+        loop = asyncio.get_running_loop()
+        key = (target_lang, tuple(sorted(options.items())))
+        future = loop.create_future()
+
+        batch = self._batches.setdefault(key, [])
+        batch.append((text, guild_id, future))
+        self.batched += 1
+
+        if len(batch) >= self.batch_max:
+            self._flush(key)
+        elif key not in self._batch_timers:
+            self._batch_timers[key] = loop.call_later(self.batch_window, self._flush, key)
+
+        return future
+
+    def _flush(self, key: tuple):
+        """まとめ待ちのメッセージを1リクエストとして送信する"""
+        timer = self._batch_timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        self.batched -= len(batch)
+
+        task = asyncio.get_running_loop().create_task(self._send_batch(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, key: tuple, batch: list[tuple[str, int, asyncio.Future]]):
+        # 含まれるサーバーすべての枠を取ってから送る（同時に送るリクエスト数をサーバーごとに制限する）
+        # 取る順番を揃えてバッチ同士が互いの枠を待ち合わないようにする
+        guilds = sorted({guild_id for _, guild_id, _ in batch}, key=str)
+        acquired = []
+        try:
+            self.waiting += len(batch)
+            try:
+                for guild_id in guilds:
+                    semaphore = self._guild_semaphores[guild_id]
+                    await semaphore.acquire()
+                    acquired.append(semaphore)
+            finally:
+                self.waiting -= len(batch)
+
+            await self._request(key, batch)
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+
+    async def _request(self, key: tuple, batch: list[tuple[str, int, asyncio.Future]]):
+        """まとめたメッセージを1リクエストでDeepLへ送り、結果をそれぞれに返す"""
+        target_lang, options = key
+
+        # 同じ文は1回だけ送る
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+
+        loop = asyncio.get_running_loop()
+        self.submitted += 1
+        try:
+            results = await loop.run_in_executor(
+                self.executor,
+                functools.partial(self._translate_blocking, texts, target_lang, **dict(options))
+            )
+        except Exception as e:
+            self.failed += len(batch)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.submitted -= 1
+
+        self.requests += 1
+        self.batched_texts += len(texts)
+        self.completed += len(batch)
+
+        translated = {text: result.text for text, result in zip(texts, results)}
+        for text, _, future in batch:
+            if not future.done():
+                future.set_result(translated[text])
+
+        if len(batch) > 1:
+            logger.debug(f"Batch translated: [target: {target_lang}, messages: {len(batch)}, texts: {len(texts)}]")
+
+    async def _run(self, text: str, target_lang: str, guild_id: int = None, **options) -> str:
+        """まとめ待ちに入れて翻訳する（サーバーの同時実行数はリクエストを送るときに守る）"""
+        if not self.translator:
+            raise RuntimeError("DeepLの認証キーが設定されていません")
+
+        return await self._enqueue(text, target_lang, options, guild_id)
+
+    async def translate(self, text: str, target_lang: str, guild_id: int = None, source_lang: str = None, **options) -> str:
+        """テキストを翻訳して結果の文字列を返す（キャッシュがあれば優先）"""
+        if self.cache:
+            cached = await self.cache.get(text, source_lang, target_lang)
+            if cached is not None:
+                return cached
+
+        if self.limiter:
+            await self.limiter.ensure_loaded(guild_id)
+
+        # 同じ文を翻訳中ならその結果を待つ（文字数は最初の1回だけ消費する）
+        key = (text, source_lang, target_lang, tuple(sorted(options.items())))
+        task = self._pending.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        # 文字数制限（制限中はキャッシュにあるものだけ翻訳される）
+        if self.limiter:
+            self.limiter.try_consume(guild_id, len(text))
+
+        task = asyncio.get_running_loop().create_task(
+            self._translate_once(text, target_lang, guild_id, source_lang, options)
+        )
+        self._pending[key] = task
+        task.add_done_callback(functools.partial(self._finish_pending, key))
+        return await asyncio.shield(task)
+
+    def _finish_pending(self, key: tuple, task: asyncio.Task):
+        self._pending.pop(key, None)
+        # 待っている呼び出しが無くなっていても例外を回収しておく
+        if not task.cancelled():
+            task.exception()
+
+    async def _translate_once(self, text: str, target_lang: str, guild_id: int, source_lang: str, options: dict) -> str:
+        try:
+            result = await self._run(text, target_lang, guild_id, **options)
+        except (Exception, asyncio.CancelledError):
+            # 翻訳できなかった分は消費しない
+            if self.limiter:
+                self.limiter.refund(guild_id, len(text))
+            raise
+
+        if self.cache:
+            await self.cache.put(text, source_lang, target_lang, result)
+
+        return result
+
+    def stats(self) -> dict:
+        """翻訳サービスの統計情報"""
+        return {
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shared": self.shared,
+            "requests": self.requests,
+            "avg_batch": self.batched_texts / self.requests if self.requests else 0.0,
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+    def close(self):
+        """スレッドプールを停止する"""
+        for timer in self._batch_timers.values():
+            timer.cancel()
+        self._batch_timers.clear()
+        for batch in self._batches.values():
+            for _, _, future in batch:
+                future.cancel()
+        self._batches.clear()
+        self.batched = 0
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache:
+            self.cache.close()
+        logger.debug("翻訳サービスを停止しました")
@@ -0,0 +1,67 @@
+import wave
+import io
+
+try:
+    import audioop
+except ImportError:  # Python 3.13以降は audioop-lts が必要
+    audioop = None
+
+# discordへ渡すPCMの形式（48kHz / ステレオ / 16bit）
+DISCORD_RATE = 48000
+DISCORD_CHANNELS = 2
+DISCORD_WIDTH = 2
+# 20ms分のバイト数
+FRAME_SIZE = DISCORD_RATE // 50 * DISCORD_CHANNELS * DISCORD_WIDTH
+
+
+def available() -> bool:
+    """プロセス内で変換できるか（できなければFFmpegを使う）"""
+    return audioop is not None
+
+
+def wav_length(data: bytes) -> float:
+    """WAVの長さ（秒）"""
+    with wave.open(io.BytesIO(data), 'rb') as f:
+        return f.getnframes() / f.getframerate()
+
+
+def to_discord_pcm(data: bytes) -> bytes:
+    """WAVのバイト列をdiscord用の生PCMへ変換する"""
+    with wave.open(io.BytesIO(data), 'rb') as f:
+        rate = f.getframerate()
+        channels = f.getnchannels()
+        width = f.getsampwidth()
+        pcm = f.readframes(f.getnframes())
+
+    # 16bitへ
+    if width != DISCORD_WIDTH:
+        if width == 1:
+            # 8bitのWAVは符号なし
+            pcm = audioop.bias(pcm, 1, -128)
+        pcm = audioop.lin2lin(pcm, width, DISCORD_WIDTH)
+
+    # 3ch以上は先頭2chを使う
+    if channels > 2:
+        frame = DISCORD_WIDTH * channels
+        pcm = b"".join(pcm[i:i + DISCORD_WIDTH * 2] for i in range(0, len(pcm), frame))
+        channels = 2
+
+    # 48kHzへ
+    if rate != DISCORD_RATE:
+        pcm, _ = audioop.ratecv(pcm, DISCORD_WIDTH, channels, rate, DISCORD_RATE, None)
+
+    # ステレオへ
+    if channels == 1:
+        pcm = audioop.tostereo(pcm, DISCORD_WIDTH, 1, 1)
+
+    # 最後のフレームが欠けないように無音で埋める
+    remainder = len(pcm) % FRAME_SIZE
+    if remainder:
+        pcm += b"\x00" * (FRAME_SIZE - remainder)
+
+    return pcm
+
+
+def apply_volume(pcm: bytes, volume: float) -> bytes:
+    """16bit PCMに音量をかける（はみ出した分は丸める）"""
+    return audioop.mul(pcm, DISCORD_WIDTH, volume)
@@ -1,24 +1,106 @@
 import threading
+import heapq
 import time
 import os
-import sys
 
 from modules.log import get_logger
 
 # loggerの設定
 logger = get_logger(__name__)
 
+# 削除に失敗したときのリトライ回数と間隔（秒）
+DELETE_RETRIES = 3
+DELETE_RETRY_INTERVAL = 5.0
+
+
+class DeleteScheduler:
+    """1つのスレッドで時間差のファイル削除をまとめて行う"""
+
+    def __init__(self):
+        # (削除する時刻, 連番, パス, 試行回数)
+        self._heap: list[tuple[float, int, str, int]] = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._thread: threading.Thread = None
+
+        self.deleted = 0
+        self.failed = 0
+        self.bytes_reclaimed = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="delete_scheduler", daemon=True)
+            self._thread.start()
+
+    def schedule(self, file_name: str, delay: float = 0, attempt: int = 0):
+        """delay秒後にファイルを削除する"""
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, file_name, attempt))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, file_name, attempt = heapq.heappop(self._heap)
+
+            self._delete(file_name, attempt)
+
+    def _delete(self, file_name: str, attempt: int):
+        try:
+            size = os.path.getsize(file_name)
+            os.remove(file_name)
+            self.deleted += 1
+            self.bytes_reclaimed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # 再生中などで削除できなければ後でもう一度試す
+            if attempt + 1 < DELETE_RETRIES:
+                self.schedule(file_name, DELETE_RETRY_INTERVAL, attempt + 1)
+            else:
+                self.failed += 1
+                logger.error(f"ファイル削除エラー: {e} {file_name}")
+
+    def sweep(self, directory: str, keep=None):
+        """起動時に残っているファイルを削除する（keep(name)がTrueのものは残す）"""
+        if not os.path.isdir(directory):
+            return
+        count = 0
+        reclaimed = 0
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path) or (keep and keep(name)):
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                count += 1
+                reclaimed += size
+            except OSError as e:
+                logger.error(f"ファイル削除エラー: {e} {path}")
+        self.deleted += count
+        self.bytes_reclaimed += reclaimed
+        if count:
+            logger.info(f"残っていた一時ファイルを削除しました: {count}件 ({reclaimed} bytes)")
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = len(self._heap)
+        return {
+            "pending": pending,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+        }
+
+
+# 共有のスケジューラー
+scheduler = DeleteScheduler()
+
 def delete_file_latency(file_name, latency):
-    task = threading.Thread(target=_delete_file_latency, args=(file_name, latency))
-    task.start()
-
-def _delete_file_latency(file_name, latency):
-    try:
-        time.sleep(latency+2.0)
-        os.remove(file_name)
-        
-    except Exception as e:
-        exception_type, exception_object, exception_traceback = sys.exc_info()
-        line_no = exception_traceback.tb_lineno
-        filename = exception_traceback.tb_frame.f_code.co_filename
-        logger.error(f"ファイル削除エラー: {e} {filename} {line_no}")
\ No newline at end of file
+    scheduler.schedule(file_name, latency)
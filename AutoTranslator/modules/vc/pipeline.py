@@ -0,0 +1,229 @@
+import threading
+import io
+
+from collections import deque
+from discord import AudioSource, FFmpegPCMAudio, PCMAudio, PCMVolumeTransformer, VoiceClient
+from modules.log import get_logger
+from modules.vc import audio
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 次の音声を待つ間に流す無音のフレーム数（これを過ぎたらプレイヤーを止める）
+IDLE_FRAMES = 10
+SILENCE = b"\x00" * audio.FRAME_SIZE
+
+
+class Clip:
+    """パイプラインで再生する1つの音声"""
+    def __init__(self, source, on_done=None):
+        self.source = source        # SynthData
+        self.on_done = on_done      # 再生が終わったとき（音声スレッドから呼ばれる）
+        self.reader: AudioSource = None
+
+    def open(self) -> AudioSource:
+        if self.source.pcm is not None:
+            self.reader = PCMAudio(io.BytesIO(self.source.pcm))
+        else:
+            self.reader = FFmpegPCMAudio(self.source.directory)
+            if not audio.available():
+                # audioopが無ければ音量はdiscordの変換を使う
+                self.reader = PCMVolumeTransformer(self.reader, volume=self.source.volume)
+        return self.reader
+
+    def close(self):
+        if self.reader:
+            self.reader.cleanup()
+            self.reader = None
+
+
+class GuildAudioPipeline(AudioSource):
+    """ボイス接続ごとに1つだけ再生し続ける音声ソース
+
+    音声ごとにプレイヤー（とFFmpeg）を作り直さず、PCMを順番に流し込む。
+    Opusへの変換はVoiceClientが持つエンコーダーが使い回される。
+    """
+
+    def __init__(self, voice_client: VoiceClient):
+        self.voice_client = voice_client
+        self._clips: deque[Clip] = deque()
+        self._current: Clip = None
+        self._idle = 0
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.played = 0
+
+    @property
+    def busy(self) -> bool:
+        """再生中または再生待ちの音声があるか"""
+        with self._lock:
+            return self._current is not None or bool(self._clips)
+
+    def push(self, source, on_done=None):
+        """音声を追加する"""
+        with self._lock:
+            self._clips.append(Clip(source, on_done))
+        self.ensure_playing()
+
+    def ensure_playing(self):
+        """プレイヤーが止まっていれば再開する（イベントループから呼ぶ）"""
+        vc = self.voice_client
+        if not vc or not vc.is_connected() or vc.is_playing() or not self.busy:
+            return
+        self._idle = 0
+        loop = vc.loop
+        vc.play(self, after=lambda e: loop.call_soon_threadsafe(self.ensure_playing))
+
+    def skip(self):
+        """再生中の音声を飛ばす"""
+        with self._lock:
+            current, self._current = self._current, None
+        if current:
+            self._finish(current)
+
+    def clear(self):
+        """すべての音声を破棄する"""
+        with self._lock:
+            clips = list(self._clips)
+            self._clips.clear()
+            current, self._current = self._current, None
+        # 再生されなかった音声も終了時の処理（一時ファイルの削除や次の再生）を行う
+        for clip in ([current] if current else []) + clips:
+            self._finish(clip, played=False)
+        if self.voice_client and self.voice_client.is_playing():
+            self.voice_client.stop()
+
+    def _finish(self, clip: Clip, played: bool = True):
+        clip.close()
+        if played:
+            self.played += 1
+        if clip.on_done:
+            try:
+                clip.on_done()
+            except Exception:
+                logger.exception("再生終了時の処理でエラーが発生しました")
+
+    def read(self) -> bytes:
+        while True:
+            with self._lock:
+                clip = self._current
+                if clip is None and self._clips:
+                    clip = self._current = self._clips.popleft()
+                    clip.open()
+                reader = clip.reader if clip else None
+
+            if clip is None:
+                # 次の音声が来るまで少しだけ無音を流す
+                self._idle += 1
+                return SILENCE if self._idle <= IDLE_FRAMES else b""
+
+            try:
+                data = reader.read() if reader else b""
+            except (ValueError, OSError):
+                # 飛ばされて閉じられた
+                data = b""
+
+            if len(data) < audio.FRAME_SIZE:
+                with self._lock:
+                    finished = self._current is clip
+                    if finished:
+                        self._current = None
+                if finished:
+                    self._finish(clip)
+                continue
+
+            self._idle = 0
+            self.frames += 1
+            volume = clip.source.volume
+            if volume != 1 and audio.available():
+                data = audio.apply_volume(data, volume)
+            return data
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        # プレイヤーが止まっても再生待ちの音声は残す
+        self._idle = 0
+
+
+pipelines: dict[int, GuildAudioPipeline] = {}
+
+def get_pipeline(voice_client: VoiceClient) -> GuildAudioPipeline:
+    """ボイス接続のパイプラインを取得（接続し直していれば作り直す）"""
+    guild_id = voice_client.guild.id
+    pipeline = pipelines.get(guild_id)
+    if pipeline is None or pipeline.voice_client is not voice_client:
+        if pipeline:
+            pipeline.clear()
+        pipeline = pipelines[guild_id] = GuildAudioPipeline(voice_client)
+    return pipeline
+
+def remove_pipeline(guild_id: int):
+    """切断時にパイプラインを破棄する"""
+    pipeline = pipelines.pop(guild_id, None)
+    if pipeline:
+        pipeline.clear()
+
+
+# ==============================
+# ベンチマーク
+# ==============================
+# AutoTranslatorディレクトリで `python -m modules.vc.pipeline` を実行
+# 1分間の音声（2秒ずつ）を再生用のPCMにする際のCPU時間を比較する
+# （Opusへのエンコードはどちらも同じなので含めない）
+if __name__ == "__main__":
+    import math
+    import os
+    import resource
+    import shutil
+    import struct
+    import tempfile
+    import time
+    import wave
+
+    CLIP_SECONDS = 2
+    TOTAL_SECONDS = 60
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(24000)
+        f.writeframes(b"".join(
+            struct.pack("<h", int(8000 * math.sin(i / 7) * math.sin(i / 2400)))
+            for i in range(24000 * CLIP_SECONDS)
+        ))
+    clip = buffer.getvalue()
+    count = TOTAL_SECONDS // CLIP_SECONDS
+
+    def cpu() -> float:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.process_time() + children.ru_utime + children.ru_stime
+
+    def drain(source: AudioSource):
+        while len(source.read()) == audio.FRAME_SIZE:
+            pass
+        source.cleanup()
+
+    if shutil.which("ffmpeg"):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "clip.wav")
+            with open(path, "wb") as f:
+                f.write(clip)
+            start = cpu()
+            for _ in range(count):
+                drain(PCMVolumeTransformer(FFmpegPCMAudio(path), volume=0.8))
+            print(f"ffmpeg per clip : {cpu() - start:6.3f} s CPU / min of speech")
+    else:
+        print("ffmpeg per clip : ffmpegが見つからないのでスキップ")
+
+    if audio.available():
+        start = cpu()
+        for _ in range(count):
+            pcm = audio.to_discord_pcm(clip)
+            reader = PCMAudio(io.BytesIO(pcm))
+            while len(data := reader.read()) == audio.FRAME_SIZE:
+                audio.apply_volume(data, 0.8)
+        print(f"in-process      : {cpu() - start:6.3f} s CPU / min of speech")
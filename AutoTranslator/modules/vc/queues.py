@@ -1,50 +1,479 @@
+import asyncio
 import discord
+import time
 import os
 from discord.ext.commands import Cog, Bot
-from discord import Message, FFmpegPCMAudio, PCMVolumeTransformer, VoiceClient, Guild
+from discord import Message, VoiceClient, Guild
 from typing import List
 from modules.env import load_env
 from modules.log import get_logger
 from modules.vc.delete import delete_file_latency
-from collections import deque, defaultdict
+from modules.vc.pipeline import get_pipeline, remove_pipeline
+from modules.vc.tts.chunk import split_text
+from collections import deque
 
 logger = get_logger(__name__)
 
+# 再生中に先読みで合成しておく数
+TTS_LOOKAHEAD = int(os.getenv("TTS_LOOKAHEAD", 2))
+# 再生終了からファイル削除までの猶予（秒）
+DELETE_GRACE = 1.0
+# 音声の長さを過ぎても再生が終わらないときに諦めるまでの余裕（秒）
+TTS_PLAY_MARGIN = float(os.getenv("TTS_PLAY_MARGIN", 5))
+# 1サーバーのキューの最大数
+TTS_QUEUE_MAX = int(os.getenv("TTS_QUEUE_MAX", 50))
+# 溢れたときに捨てる方（oldest: 古いもの / newest: 新しく来たもの）
+TTS_DROP_POLICY = os.getenv("TTS_DROP_POLICY", "oldest")
+
+# 優先度（小さいほど先に再生する）
+PRIORITY_ANNOUNCE = 0   # 入退室・接続メッセージ
+PRIORITY_SOUNDTEXT = 1  # サウンドテキスト
+PRIORITY_TTS = 2        # 通常の読み上げ
+PRIORITIES = (PRIORITY_ANNOUNCE, PRIORITY_SOUNDTEXT, PRIORITY_TTS)
+
+# 優先度ごとの古すぎて読まない秒数（Noneなら捨てない）
+TTS_STALE_SECONDS = {
+    PRIORITY_ANNOUNCE: None,
+    PRIORITY_SOUNDTEXT: float(os.getenv("TTS_STALE_SOUNDTEXT", 60)),
+    PRIORITY_TTS: float(os.getenv("TTS_STALE_SECONDS", 30)),
+}
+# 1人が通常の読み上げで溜められる数（超えたら古いものから捨てる、0で無制限）
+TTS_FLOOD_MAX = int(os.getenv("TTS_FLOOD_MAX", 3))
+# 告知が来たら再生中の通常の読み上げを止めるか
+TTS_PREEMPT = os.getenv("TTS_PREEMPT", "0") == "1"
+
+# 溜まり具合に応じて読み上げ速度を上げるか
+TTS_ADAPTIVE_SPEED = os.getenv("TTS_ADAPTIVE_SPEED", "0") == "1"
+# 速度を上げ始める遅れ（秒）と、最大まで上げる遅れ（秒）
+TTS_ADAPTIVE_FROM = float(os.getenv("TTS_ADAPTIVE_FROM", 10))
+TTS_ADAPTIVE_TO = float(os.getenv("TTS_ADAPTIVE_TO", 60))
+# 設定された速度に掛ける倍率の上限と、speedScaleそのものの上限
+TTS_ADAPTIVE_MAX = float(os.getenv("TTS_ADAPTIVE_MAX", 1.5))
+TTS_SPEED_LIMIT = float(os.getenv("TTS_SPEED_LIMIT", 2.0))
+# 合成前のテキストの長さを見積もるための1秒あたりの文字数
+TTS_CHARS_PER_SECOND = float(os.getenv("TTS_CHARS_PER_SECOND", 7))
+
+# 長いテキストを文ごとに区切って合成するか
+TTS_CHUNKING = os.getenv("TTS_CHUNKING", "1") == "1"
+# 1つの読み上げで同時に合成する塊の数
+TTS_CHUNK_CONCURRENCY = int(os.getenv("TTS_CHUNK_CONCURRENCY", 2))
+
 class SynthData:
-    def __init__(self, directory: str, length: float, volume: float):
+    def __init__(self, directory: str, length: float, volume: float, temporary: bool = True, pcm: bytes = None):
         self.directory = directory
         self.length = length
         self.volume = volume
+        # Falseならキャッシュのファイルなので再生後に削除しない
+        self.temporary = temporary
+        # 変換済みのPCM（あればFFmpegを使わずに再生する）
+        self.pcm = pcm
 
-server_queue = defaultdict(deque)
+class TTSJob:
+    """まだ合成していない読み上げ
 
-def queue(filelist: SynthData, guild: Guild):
-    """形式: [ディレクトリ、　レイテンシ、音量]"""
-    
-    queue = server_queue[guild.id]
-    queue.append(filelist)
+    長いテキストは文ごとに区切って並列に合成し、最初の塊から再生できるようにする。
+    """
+    def __init__(self, content: str, spkID: int, speed: float = 1, volume: float = 1, length_limit: int = None):
+        if length_limit:
+            # サーバー設定の文字数制限
+            content = content[:length_limit]
+        self.content = content
+        self.spkID = spkID
+        self.speed = speed
+        self.volume = volume
+        # 実際に合成に使った速度
+        self.applied_speed = speed
+        self.chunks = split_text(content) if TTS_CHUNKING else [content]
+        self.tasks: list[asyncio.Task] = []
+        # 再生に渡した塊の数
+        self.consumed = 0
 
-    logger.debug(f"Queue Added: [server_id: {guild.id}, file: {filelist.directory}]")
+    @property
+    def task(self) -> asyncio.Task:
+        """最初の塊の合成タスク（開始前はNone）"""
+        return self.tasks[0] if self.tasks else None
+
+    def start(self, speed_factor: float = 1.0):
+        """合成を開始する（開始済みなら何もしない）"""
+        if self.tasks:
+            return
+        if speed_factor != 1.0:
+            self.applied_speed = round(min(max(self.speed * speed_factor, self.speed), TTS_SPEED_LIMIT), 2)
+        semaphore = asyncio.Semaphore(max(1, TTS_CHUNK_CONCURRENCY))
+        # 先に作ったタスクから順に枠を取るので最初の塊が先に合成される
+        self.tasks = [asyncio.create_task(self._synthesis(chunk, semaphore)) for chunk in self.chunks]
+
+    async def _synthesis(self, chunk: str, semaphore: asyncio.Semaphore):
+        # voicevoxはSynthDataのためにこのモジュールを読み込むのでここで読み込む
+        from modules.vc.tts import voicevox
+        async with semaphore:
+            return await voicevox.synthesis(chunk, self.spkID, self.applied_speed)
+
+    def seconds(self) -> float:
+        """再生にかかる秒数（合成前は文字数から見積もる）"""
+        total = 0.0
+        for i, chunk in enumerate(self.chunks):
+            if i < self.consumed:
+                continue
+            if i < len(self.tasks) and self.tasks[i].done():
+                source = self.result(i)
+                total += source.length if source else 0.0
+            else:
+                total += len(chunk) / TTS_CHARS_PER_SECOND / max(self.applied_speed, 0.1)
+        return total
+
+    def result(self, index: int = 0):
+        """合成結果（失敗していればNone）"""
+        task = self.tasks[index]
+        if task.cancelled() or task.exception():
+            return None
+        source: SynthData = task.result()
+        if source:
+            source.volume = self.volume
+        return source
+
+    async def next_chunk(self):
+        """次の塊の合成を待って返す（失敗した塊は飛ばし、残りが無ければNone）"""
+        while self.consumed < len(self.tasks):
+            index = self.consumed
+            await asyncio.wait({self.tasks[index]})
+            self.consumed += 1
+            source = self.result(index)
+            if source is not None:
+                return source
+        return None
+
+    def cancel(self):
+        """まだ再生していない塊の合成を中止し、合成済みの一時ファイルは削除する"""
+        for index in range(self.consumed, len(self.tasks)):
+            task = self.tasks[index]
+            if not task.done():
+                task.cancel()
+                continue
+            source = self.result(index)
+            if source and source.directory and source.temporary:
+                delete_file_latency(source.directory, 0)
+        self.consumed = len(self.tasks)
+
+class QueueEntry:
+    """キューに入っている1つの項目"""
+    def __init__(self, item, priority: int = PRIORITY_TTS, author_id: int = None):
+        self.item = item    # SynthData または TTSJob
+        self.priority = priority
+        self.author_id = author_id
+        self.enqueued_at = time.monotonic()
+
+    def is_stale(self, now: float) -> bool:
+        limit = TTS_STALE_SECONDS.get(self.priority)
+        return limit is not None and now - self.enqueued_at > limit
+
+    def cancel(self):
+        if isinstance(self.item, TTSJob):
+            self.item.cancel()
+        elif self.item.directory and self.item.length != -1 and self.item.temporary:
+            delete_file_latency(self.item.directory, 0)
+
+
+class GuildAudioQueue:
+    """サーバーごとの再生キュー（イベントループ上の1つのタスクが順番に再生する）"""
+
+    def __init__(self, guild: Guild, max_length: int = TTS_QUEUE_MAX, drop_policy: str = TTS_DROP_POLICY):
+        self.guild = guild
+        self.max_length = max_length
+        self.drop_policy = drop_policy
+
+        # 優先度ごとのキュー
+        self.lanes: dict[int, deque[QueueEntry]] = {priority: deque() for priority in PRIORITIES}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._playing: QueueEntry = None
+        self._playing_source: SynthData = None
+        self._playing_since = 0.0
+
+        # 統計
+        self.enqueued = 0
+        self.played = 0
+        self.dropped = 0
+        self.stale = 0
+        self.collapsed = 0
+        self.preempted = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_behind = 0.0
+        self.speed_factor = 1.0
+        self.sped_up = 0
+
+    # ------------------------------
+    # 追加・操作（イベントループから呼ぶ）
+    # ------------------------------
+    @property
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def ordered(self) -> list[QueueEntry]:
+        """再生される順に並べた項目"""
+        return [entry for priority in PRIORITIES for entry in self.lanes[priority]]
+
+    def _drop(self, entry: QueueEntry):
+        self.lanes[entry.priority].remove(entry)
+        entry.cancel()
+
+    def put(self, item, priority: int = PRIORITY_TTS, author_id: int = None) -> bool:
+        """項目を追加する（溢れた場合はポリシーに従って捨てる）"""
+        entry = QueueEntry(item, priority, author_id)
+
+        # 同じ人の連投はまとめて古いものを捨てる
+        if priority == PRIORITY_TTS and author_id is not None and TTS_FLOOD_MAX > 0:
+            own = [e for e in self.lanes[PRIORITY_TTS] if e.author_id == author_id]
+            for old in own[:max(0, len(own) - TTS_FLOOD_MAX + 1)]:
+                self._drop(old)
+                self.collapsed += 1
+
+        if self.depth >= self.max_length:
+            # 捨てるのは一番優先度の低いもの
+            lowest = next(p for p in reversed(PRIORITIES) if self.lanes[p])
+            if self.drop_policy == "newest" or lowest < priority:
+                self.dropped += 1
+                entry.cancel()
+                logger.debug(f"Queue full, dropped new item: [server_id: {self.guild.id}]")
+                return False
+            self._drop(self.lanes[lowest][0])
+            self.dropped += 1
+            logger.debug(f"Queue full, dropped oldest item: [server_id: {self.guild.id}]")
+
+        self.lanes[priority].append(entry)
+        self.enqueued += 1
+        self.max_behind = max(self.max_behind, self.behind())
+        self.prefetch()
+
+        # 告知は再生中の通常の読み上げを止めて割り込む
+        if TTS_PREEMPT and priority == PRIORITY_ANNOUNCE and self._playing and self._playing.priority == PRIORITY_TTS:
+            self.preempted += 1
+            self.skip()
 
-    if not guild.voice_client.is_playing():
-        play(queue, guild.voice_client)
-        
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return True
 
-def play(queue: deque, voice_client: VoiceClient):
+    def prefetch(self):
+        """再生順の先頭からTTS_LOOKAHEAD個の合成を開始しておく"""
+        for entry in self.ordered()[:max(1, TTS_LOOKAHEAD)]:
+            self._start(entry)
+
+    def _start(self, entry: QueueEntry):
+        if isinstance(entry.item, TTSJob) and entry.item.task is None:
+            entry.item.start(self._adapt_speed())
+            if entry.item.applied_speed != entry.item.speed:
+                self.sped_up += 1
+
+    # ------------------------------
+    # 速度の自動調整
+    # ------------------------------
+    def behind(self) -> float:
+        """リアルタイムからの遅れ（再生中の残りとキューの合計秒数）"""
+        seconds = 0.0
+        if self._playing_source is not None:
+            elapsed = time.monotonic() - self._playing_since
+            seconds += max(0.0, self._playing_source.length - elapsed)
+            if isinstance(self._playing.item, TTSJob):
+                # 再生中の読み上げの残りの塊
+                seconds += self._playing.item.seconds()
+        for entry in self.ordered():
+            item = entry.item
+            seconds += item.seconds() if isinstance(item, TTSJob) else max(item.length, 0.0)
+        return seconds
+
+    def _adapt_speed(self) -> float:
+        """遅れに応じて速度の倍率を決める（キューが空けば1に戻る）"""
+        behind = self.behind()
+        self.max_behind = max(self.max_behind, behind)
+        if not TTS_ADAPTIVE_SPEED:
+            return 1.0
+
+        span = max(TTS_ADAPTIVE_TO - TTS_ADAPTIVE_FROM, 1e-6)
+        ratio = min(max((behind - TTS_ADAPTIVE_FROM) / span, 0.0), 1.0)
+        self.speed_factor = 1.0 + (TTS_ADAPTIVE_MAX - 1.0) * ratio
+        return self.speed_factor
+
+    def skip(self):
+        """再生中のものを飛ばす（区切って合成したものは残りの塊も飛ばす）"""
+        if self._playing and isinstance(self._playing.item, TTSJob):
+            self._playing.item.cancel()
+        if self.guild.voice_client:
+            get_pipeline(self.guild.voice_client).skip()
+
+    def close(self):
+        """キューを破棄する（切断時など）"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for entry in self.ordered() + ([self._playing] if self._playing else []):
+            entry.cancel()
+        for lane in self.lanes.values():
+            lane.clear()
+        remove_pipeline(self.guild.id)
+
+    # ------------------------------
+    # 再生タスク
+    # ------------------------------
+    def _head(self):
+        """次に再生する項目（古すぎるものは捨てる）"""
+        now = time.monotonic()
+        for priority in PRIORITIES:
+            lane = self.lanes[priority]
+            while lane and lane[0].is_stale(now):
+                lane.popleft().cancel()
+                self.stale += 1
+            if lane:
+                return lane[0]
+        return None
+
+    async def _next(self):
+        """次に再生するQueueEntryとSynthDataを取り出す"""
+        while True:
+            entry = self._head()
+            while entry is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                entry = self._head()
+
+            if isinstance(entry.item, TTSJob):
+                self._start(entry)
+                # 合成が終わるまで待つ（途中で捨てられたり、優先度の高いものが来た場合も戻ってくる）
+                self._wakeup.clear()
+                wakeup = asyncio.create_task(self._wakeup.wait())
+                await asyncio.wait({entry.item.task, wakeup}, return_when=asyncio.FIRST_COMPLETED)
+                wakeup.cancel()
+
+                if not entry.item.task.done():
+                    continue
+
+            if self._head() is not entry:
+                continue
+            self.lanes[entry.priority].popleft()
+
+            source = await entry.item.next_chunk() if isinstance(entry.item, TTSJob) else entry.item
+            if source is None:
+                # 合成に失敗したものは飛ばす
+                self.failed += 1
+                continue
+
+            wait = time.monotonic() - entry.enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            return entry, source
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            entry, source = await self._next()
+
+            # 次の分の合成を始めておく
+            self.prefetch()
+
+            self._playing = entry
+            try:
+                while source is not None:
+                    await self._play(entry, source, loop)
+                    # 長いテキストは残りの塊を順番に再生する（飛ばされた場合は無い）
+                    source = await entry.item.next_chunk() if isinstance(entry.item, TTSJob) else None
+            finally:
+                self._playing = None
+            self.played += 1
+
+    async def _play(self, entry: QueueEntry, source: SynthData, loop: asyncio.AbstractEventLoop):
+        """1つの音声を再生し終わるまで待つ"""
+        voice_client = self.guild.voice_client
+        if not voice_client:
+            QueueEntry(source).cancel()
+            entry.cancel()
+            return
+
+        # 再生ごとに別のイベントを使う（諦めた後に古い音声の終了が届いても次の再生に影響しない）
+        clip_done = asyncio.Event()
+
+        def after(source=source):
+            ## 再生が終わったら（飛ばされた場合も）ファイルを削除する。
+            if source.directory and source.length != -1 and source.temporary:
+                delete_file_latency(source.directory, DELETE_GRACE)
+            # 音声スレッドから呼ばれるのでイベントループに戻して次を再生する
+            loop.call_soon_threadsafe(clip_done.set)
+
+        # 接続ごとのパイプラインに流し込む（FFmpegやプレイヤーを毎回作らない）
+        self._playing_source = source
+        self._playing_since = time.monotonic()
+        pipeline = get_pipeline(voice_client)
+        pipeline.push(source, on_done=after)
+        logger.debug(f"Playing: [server_id: {self.guild.id}, priority: {entry.priority}, file: {source.directory or 'memory'}]")
+
+        try:
+            # プレイヤーが途中で止まると終了が届かないので、長さ＋余裕で諦める
+            await asyncio.wait_for(clip_done.wait(), max(source.length, 0) + TTS_PLAY_MARGIN)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"再生が終わらないので次へ進みます: [server_id: {self.guild.id}]")
+            # 残っている音声は破棄する（一時ファイルの削除も行われる）
+            pipeline.clear()
+        finally:
+            self._playing_source = None
+
+    def stats(self) -> dict:
+        """キューの統計情報"""
+        now = time.monotonic()
+        entries = self.ordered()
+        return {
+            "depth": len(entries),
+            "lanes": {priority: len(lane) for priority, lane in self.lanes.items()},
+            "oldest_wait": max((now - e.enqueued_at for e in entries), default=0.0),
+            "avg_wait": self.total_wait / self.played if self.played else 0.0,
+            "max_wait": self.max_wait,
+            "behind": self.behind(),
+            "max_behind": self.max_behind,
+            "speed_factor": self.speed_factor,
+            "sped_up": self.sped_up,
+            "enqueued": self.enqueued,
+            "played": self.played,
+            "dropped": self.dropped,
+            "stale": self.stale,
+            "collapsed": self.collapsed,
+            "preempted": self.preempted,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+        }
+
+
+guild_queues: dict[int, GuildAudioQueue] = {}
+
+def get_queue(guild: Guild) -> GuildAudioQueue:
+    audio_queue = guild_queues.get(guild.id)
+    if audio_queue is None:
+        audio_queue = guild_queues[guild.id] = GuildAudioQueue(guild)
+    return audio_queue
+
+def queue(filelist: SynthData, guild: Guild, priority: int = PRIORITY_TTS, author_id: int = None):
+    """形式: [ディレクトリ、　レイテンシ、音量]"""
+    logger.debug(f"Queue Added: [server_id: {guild.id}, file: {filelist.directory}]")
+    get_queue(guild).put(filelist, priority, author_id)
 
-    if not voice_client or not queue:
-        return
-    if voice_client.is_playing():
-        return
-    
-    source: SynthData = queue.popleft()
-    
-    pcmaudio_fixed = PCMVolumeTransformer(FFmpegPCMAudio(source.directory))
-    pcmaudio_fixed.volume = source.volume
+def queue_text(job: TTSJob, guild: Guild, priority: int = PRIORITY_TTS, author_id: int = None):
+    """テキストをキューに追加する（合成は再生中に先読みで行う）"""
+    logger.debug(f"Queue Added: [server_id: {guild.id}, text: {job.content}]")
+    get_queue(guild).put(job, priority, author_id)
 
-    voice_client.play(pcmaudio_fixed, after=lambda e:play(queue, voice_client))
-    logger.debug(f"Playing: [server_id: {voice_client.guild.id}, file: {source.directory}]")
+def skip(guild: Guild):
+    """再生中のものを飛ばす"""
+    audio_queue = guild_queues.get(guild.id)
+    if audio_queue:
+        audio_queue.skip()
 
-    if source.length != -1:
-        ## 再生スタートが完了したら時間差でファイルを削除する。
-        delete_file_latency(source.directory, source.length+1)
\ No newline at end of file
+def clear(guild: Guild):
+    """キューを破棄してメモリを解放する（切断時など）"""
+    audio_queue = guild_queues.pop(guild.id, None)
+    if audio_queue:
+        audio_queue.close()
+    else:
+        remove_pipeline(guild.id)
@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import os
+
+from collections import OrderedDict
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 音声キャッシュの上限（バイト）
+TTS_CACHE_BYTES = int(os.getenv("TTS_CACHE_BYTES", 512 * 1024 * 1024))
+
+
+def make_key(content: str, spkID: int, speed: float, engine_version: str) -> str:
+    """(テキスト, 話者, 速度, エンジンのバージョン) からキャッシュのキーを作る"""
+    raw = f"{content}\0{spkID}\0{float(speed):.3f}\0{engine_version}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class AudioCache:
+    """合成済み音声をファイル名=ハッシュで保存するLRUキャッシュ"""
+
+    def __init__(self, directory: str, max_bytes: int = TTS_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # ファイル名 -> サイズ（古い順）
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._scan()
+
+    def _scan(self):
+        """既存のキャッシュファイルを更新日時の古い順に読み込む"""
+        if not os.path.isdir(self.directory):
+            return
+        files = []
+        for name in os.listdir(self.directory):
+            if not self.owns(name):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        logger.debug(f"音声キャッシュ: {len(self._entries)}件 ({self._size} bytes)")
+
+    @staticmethod
+    def owns(name: str) -> bool:
+        """キャッシュが管理しているファイルか"""
+        stem, ext = os.path.splitext(os.path.basename(name))
+        return ext == ".wav" and len(stem) == 64 and all(c in "0123456789abcdef" for c in stem)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, key: str):
+        """キャッシュ済みならファイルのパスを返す"""
+        name = f"{key}.wav"
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+
+        path = self.path(key)
+        try:
+            # 再起動後もLRUの順番を保つために更新日時を更新
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """音声を保存してパスを返す"""
+        name = f"{key}.wav"
+        path = self.path(key)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            evicted = self._evict()
+
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError as e:
+                # 再生中などで削除できなければ次の機会に回す
+                logger.debug(f"音声キャッシュを削除できませんでした: {old} {e}")
+        return path
+
+    def _evict(self) -> list[str]:
+        evicted = []
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            evicted.append(name)
+        return evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
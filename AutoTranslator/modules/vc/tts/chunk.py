@@ -0,0 +1,48 @@
+import re
+import os
+
+# 1つの塊の最大文字数（超えたら読点などでさらに区切る）
+TTS_CHUNK_MAX = int(os.getenv("TTS_CHUNK_MAX", 40))
+# これより短い塊は次とまとめる（リクエストが細かくなりすぎないように）
+TTS_CHUNK_MIN = int(os.getenv("TTS_CHUNK_MIN", 8))
+
+# 文の区切り（区切り文字は前の文に含める）
+SENTENCE_END = re.compile(r"(?<=[。．！？!?\n])|(?<=\. )")
+# 長すぎる文を区切る位置
+CLAUSE_END = re.compile(r"(?<=[、，,;；:：　 ])")
+
+
+def _pack(pieces: list[str], limit: int) -> list[str]:
+    """limitを超えない範囲で前から順に詰める"""
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(piece) <= limit:
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def split_text(content: str, max_length: int = TTS_CHUNK_MAX, min_length: int = TTS_CHUNK_MIN) -> list[str]:
+    """読み上げるテキストを文や句読点の位置で区切る"""
+    pieces = []
+    for sentence in SENTENCE_END.split(content):
+        if len(sentence) > max_length:
+            for clause in _pack(CLAUSE_END.split(sentence), max_length):
+                # 区切る場所が無ければ文字数で切る
+                pieces.extend(clause[i:i + max_length] for i in range(0, len(clause), max_length))
+        elif sentence:
+            pieces.append(sentence)
+
+    # 短すぎる塊は次とまとめる
+    chunks = []
+    for piece in pieces:
+        if not piece.strip():
+            if chunks:
+                chunks[-1] += piece
+            continue
+        if chunks and len(chunks[-1].strip()) < min_length and len(chunks[-1]) + len(piece) <= max_length:
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+    return [chunk.strip() for chunk in chunks if chunk.strip()] or ([content] if content.strip() else [])
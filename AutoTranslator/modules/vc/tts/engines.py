@@ -0,0 +1,139 @@
+import asyncio
+import time
+import os
+
+from modules.log import get_logger
+
+# loggerの設定
+logger = get_logger(__name__)
+
+VC_HOST = "127.0.0.1"
+VC_PORT = 50021
+# 使うエンジン（"host:port,host:port" の形式、未設定ならVC_HOST:VC_PORTの1台）
+VC_ENGINES = os.getenv("VC_ENGINES", f"{VC_HOST}:{VC_PORT}")
+# この回数続けて失敗したエンジンは一時的に使わない
+VC_BREAKER_FAILURES = int(os.getenv("VC_BREAKER_FAILURES", 3))
+# 使わない時間（秒）
+VC_BREAKER_COOLDOWN = float(os.getenv("VC_BREAKER_COOLDOWN", 30))
+# 死活確認の間隔（秒）
+VC_HEALTH_INTERVAL = float(os.getenv("VC_HEALTH_INTERVAL", 10))
+# 話者を担当しているエンジンの処理中の数が最小よりこれだけ多くなるまでは同じエンジンを使う
+VC_STICKY_SLACK = int(os.getenv("VC_STICKY_SLACK", 2))
+
+
+def engine_urls(engines: str = VC_ENGINES) -> list[str]:
+    """設定からエンジンのURLの一覧を作る"""
+    urls = []
+    for engine in engines.split(","):
+        engine = engine.strip()
+        if not engine:
+            continue
+        if not engine.startswith("http"):
+            engine = f"http://{engine}"
+        urls.append(engine.rstrip("/"))
+    return urls or [f"http://{VC_HOST}:{VC_PORT}"]
+
+
+class Engine:
+    """1つのVOICEVOXエンジン"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        # 処理中のリクエスト数
+        self.outstanding = 0
+        # 続けて失敗した回数
+        self.failures = 0
+        # この時刻までは使わない（サーキットブレーカー）
+        self.open_until = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.trips = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def success(self):
+        if self.failures >= VC_BREAKER_FAILURES:
+            logger.info(f"VOICEVOXエンジンが復帰しました: {self.base_url}")
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self):
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= VC_BREAKER_FAILURES:
+            if self.open_until <= time.monotonic():
+                self.trips += 1
+                logger.warning(f"VOICEVOXエンジンを一時的に切り離します: {self.base_url}")
+            self.open_until = time.monotonic() + VC_BREAKER_COOLDOWN
+
+    def stats(self) -> dict:
+        return {
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "trips": self.trips,
+            "available": self.available(time.monotonic()),
+        }
+
+
+class EnginePool:
+    """処理中のリクエストが最も少ないエンジンへ振り分ける
+
+    話者ごとに同じエンジンを使い続け、読み込み済みのモデルを使い回す。
+    """
+
+    def __init__(self, urls: list[str] = None):
+        self.engines = [Engine(url) for url in (urls or engine_urls())]
+        # 話者ID -> エンジン
+        self._sticky: dict[int, Engine] = {}
+        self._probe_task: asyncio.Task = None
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def pick(self, spkID: int = None, exclude: Engine = None) -> Engine:
+        """リクエストを送るエンジンを選ぶ"""
+        now = time.monotonic()
+        candidates = [e for e in self.engines if e.available(now) and e is not exclude]
+        if not candidates:
+            candidates = [e for e in self.engines if e.available(now)]
+        if not candidates:
+            # すべて切り離されていれば一番早く戻るものを試す
+            return min(self.engines, key=lambda e: e.open_until)
+
+        least = min(candidates, key=lambda e: e.outstanding)
+        if spkID is None:
+            return least
+
+        sticky = self._sticky.get(spkID)
+        if sticky in candidates and sticky.outstanding <= least.outstanding + VC_STICKY_SLACK:
+            return sticky
+        self._sticky[spkID] = least
+        return least
+
+    def ensure_probing(self, probe):
+        """死活確認を始める（probe(engine)はエンジンが応答すればTrueを返す）"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop(probe))
+
+    async def _probe_loop(self, probe):
+        while True:
+            await asyncio.sleep(VC_HEALTH_INTERVAL)
+            results = await asyncio.gather(*(probe(e) for e in self.engines), return_exceptions=True)
+            for engine, ok in zip(self.engines, results):
+                if ok is True:
+                    engine.success()
+                else:
+                    # 応答が無ければすぐに切り離す
+                    engine.failures = max(engine.failures, VC_BREAKER_FAILURES - 1)
+                    engine.failure()
+
+    def stop(self):
+        if self._probe_task:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def stats(self) -> dict:
+        return {engine.base_url: engine.stats() for engine in self.engines}
@@ -5,9 +5,7 @@ from discord import app_commands
 from modules.log import get_logger
 from discord.app_commands import Choice
 from dotenv import load_dotenv
-
-VC_HOST = "localhost"
-VC_PORT = 50021
+from modules.vc.tts.engines import engine_urls
 
 class VoiceVoxSpeaker:
     def __init__(self, name: str, uuid: int, styles: list = []):
@@ -35,9 +33,18 @@ logger = get_logger(__name__)
 def load_from_voicevox_app():
     #スピーカー情報を取得し、jsonに変換
     try:   
-        #VOICEVOXにリクエスト
-        spk_req = requests.get(url=f"http://{VC_HOST}:{VC_PORT}/speakers")
-        des_spks = spk_req.json()
+        #VOICEVOXにリクエスト（応答したエンジンから取得する）
+        des_spks = None
+        for url in engine_urls():
+            try:
+                spk_req = requests.get(url=f"{url}/speakers", timeout=10)
+                spk_req.raise_for_status()
+                des_spks = spk_req.json()
+                break
+            except requests.RequestException:
+                logger.warning(f"VOICEVOXエンジンから話者を取得できませんでした: {url}")
+        if des_spks is None:
+            raise ConnectionError("応答するVOICEVOXエンジンがありません")
 
         spk_list: list[VoiceVoxSpeaker] = []
 
@@ -1,69 +1,309 @@
-import requests
-import json
+import aiohttp
+import asyncio
 import random
 import string
+import time
 import wave
 import os
 
-from modules.log import get_logger 
+from collections import OrderedDict
+from modules.log import get_logger
 from modules.vc.queues import SynthData
+from modules.vc.tts.cache import AudioCache, make_key, TTS_CACHE_BYTES
+from modules.vc import audio
+from modules.vc.delete import scheduler
+from modules.vc.tts.engines import EnginePool, Engine, VC_HOST, VC_PORT
 
 # loggerの設定
 logger = get_logger(__name__)
 
 VC_OUTPUT = "./tts_cache/"
 FS = 24000
-VC_HOST = "127.0.0.1"
-VC_PORT = 50021
+# VOICEVOXへのリクエストのタイムアウト（秒）
+VC_TIMEOUT = float(os.getenv("VC_TIMEOUT", 30))
+# 失敗したときのリトライ回数
+VC_RETRIES = int(os.getenv("VC_RETRIES", 3))
+# エンジン1台あたりの同時に合成する数（エンジンの処理能力に合わせる）
+VC_CONCURRENCY = int(os.getenv("VC_CONCURRENCY", 2))
+# 音声をメモリ上で変換して再生する（FFmpegとファイルの読み書きを使わない）
+TTS_IN_MEMORY = os.getenv("TTS_IN_MEMORY", "1") == "1"
+# audio_queryの結果を覚えておく数（0で無効）
+TTS_QUERY_CACHE = int(os.getenv("TTS_QUERY_CACHE", 1024))
 
 if not os.path.exists(VC_OUTPUT):
     os.mkdir(VC_OUTPUT)
+else:
+    # 前回の起動で残った一時ファイルを削除（キャッシュは残す）
+    scheduler.sweep(VC_OUTPUT, keep=AudioCache.owns)
 
 def make_id(n):
    randlst = [random.choice(string.ascii_letters + string.digits) for i in range(n)]
    return ''.join(randlst)
 
-def synthesis(content: str, spkID: int, speed: float = 1):
-    logger.debug(f'Creating audio: {content}')
-    logger.debug(f'Using speaker ID: {spkID}')
-    logger.debug(f'Using speed: {speed}')
-
-    params = (
-        ('text', content),
-        ('speaker', spkID)
-    )
-    _query = requests.post(
-        f'http://{VC_HOST}:{VC_PORT}/audio_query',
-        params=params
-    )
-    query = _query.json()
-    query["speedScale"] = speed
-
-    synthesis = requests.post(
-        f'http://{VC_HOST}:{VC_PORT}/synthesis',
-        headers = {"Content-Type": "application/json"},
-        params = params,
-        data = json.dumps(query)
-    )
-    voice_byte = synthesis.content
-
-    # ランダムなIDを生成する
-    random_id = make_id(12)
-    file_dir = os.path.join(VC_OUTPUT, f"{random_id}.wav")
-
-    if synthesis.status_code == 200:
-        with open(file_dir, "wb") as f:
-            f.write(voice_byte)
-    else:
-        logger.error(f"音声合成エラー: {synthesis.status_code} {synthesis.text}")
-        return None
-
-    with wave.open(file_dir,  'rb') as f:
+
+class VoiceVoxError(Exception):
+    """VOICEVOXとの通信エラー"""
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status} {message}")
+        self.status = status
+
+
+class QueryCache:
+    """(テキスト, 話者) ごとのaudio_queryの結果を覚えておくLRUキャッシュ
+
+    速度や音量が変わってもアクセントなどは同じなので、/synthesisだけで済む。
+    """
+
+    def __init__(self, max_entries: int = TTS_QUERY_CACHE):
+        self.max_entries = max_entries
+        # キー -> (クエリ, 取得にかかった秒数)
+        self._entries: OrderedDict[tuple[str, int], tuple[dict, float]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.time_saved = 0.0
+
+    def get(self, content: str, spkID: int):
+        entry = self._entries.get((content, spkID))
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((content, spkID))
+        query, elapsed = entry
+        self.hits += 1
+        self.time_saved += elapsed
+        # speedScaleなどを書き換えるのでコピーを返す
+        return dict(query)
+
+    def put(self, content: str, spkID: int, query: dict, elapsed: float):
+        self._entries[(content, spkID)] = (dict(query), elapsed)
+        self._entries.move_to_end((content, spkID))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "time_saved": self.time_saved,
+        }
+
+
+class VoiceVoxClient:
+    """接続を使い回す非同期のVOICEVOXクライアント"""
+
+    def __init__(self, pool: EnginePool = None,
+                 concurrency: int = VC_CONCURRENCY,
+                 timeout: float = VC_TIMEOUT,
+                 retries: int = VC_RETRIES,
+                 cache: AudioCache = None,
+                 in_memory: bool = TTS_IN_MEMORY,
+                 query_cache: QueryCache = None):
+        self.pool = pool or EnginePool()
+        self.cache = cache
+        self.query_cache = query_cache
+        self.in_memory = in_memory and audio.available()
+        self._version: str = None
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+
+        self._session: aiohttp.ClientSession = None
+        self._semaphore = asyncio.Semaphore(concurrency * len(self.pool))
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency * 2 * len(self.pool), keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, json_body: bool = False, spkID: int = None, **kwargs):
+        """リトライ付きでリクエストを送る（失敗したら別のエンジンで試す）"""
+        session = self._get_session()
+        self.pool.ensure_probing(self._probe)
+        engine = None
+
+        for attempt in range(1, self.retries + 1):
+            engine = self.pool.pick(spkID, exclude=engine)
+            engine.outstanding += 1
+            engine.requests += 1
+            try:
+                async with session.request(method, f"{engine.base_url}{path}", **kwargs) as response:
+                    if not 200 <= response.status < 300:
+                        raise VoiceVoxError(response.status, await response.text())
+                    result = await response.json() if json_body else await response.read()
+                engine.success()
+                return result
+
+            except VoiceVoxError as e:
+                # 4xxはリトライしても結果が変わらない
+                if e.status < 500:
+                    engine.success()
+                    raise
+                engine.failure()
+                if attempt == self.retries:
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                engine.failure()
+                if attempt == self.retries:
+                    raise VoiceVoxError(0, str(e)) from e
+                error = e
+            finally:
+                engine.outstanding -= 1
+
+            backoff = 0.2 * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning(f"VOICEVOXへのリクエストに失敗しました。リトライします ({attempt}/{self.retries}): {engine.base_url} {error}")
+            await asyncio.sleep(backoff)
+
+    async def audio_query(self, content: str, spkID: int) -> dict:
+        return await self._request(
+            "POST", "/audio_query",
+            json_body=True,
+            spkID=spkID,
+            params={"text": content, "speaker": spkID}
+        )
+
+    async def cached_audio_query(self, content: str, spkID: int) -> dict:
+        """キャッシュがあればそれを使ってaudio_queryを行う"""
+        if self.query_cache is None:
+            return await self.audio_query(content, spkID)
+        query = self.query_cache.get(content, spkID)
+        if query is None:
+            start = time.perf_counter()
+            query = await self.audio_query(content, spkID)
+            self.query_cache.put(content, spkID, query, time.perf_counter() - start)
+        return query
+
+    async def synthesize(self, query: dict, spkID: int) -> bytes:
+        return await self._request(
+            "POST", "/synthesis",
+            spkID=spkID,
+            params={"speaker": spkID},
+            json=query
+        )
+
+    async def initialize_speaker(self, spkID: int):
+        """話者のモデルを読み込んでおく（読み込み済みなら何もしない）"""
+        await self._request(
+            "POST", "/initialize_speaker",
+            spkID=spkID,
+            params={"speaker": spkID, "skip_reinit": "true"}
+        )
+
+    async def speakers(self) -> list:
+        return await self._request("GET", "/speakers", json_body=True)
+
+    async def _probe(self, engine: Engine) -> bool:
+        """エンジンが応答するか（死活確認）"""
+        try:
+            async with self._get_session().get(f"{engine.base_url}/version", timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def version(self) -> str:
+        """エンジンのバージョン（キャッシュのキーに使う）"""
+        if self._version is None:
+            try:
+                self._version = str(await self._request("GET", "/version", json_body=True))
+            except VoiceVoxError as e:
+                logger.error(f"VOICEVOXのバージョンを取得できませんでした: {e}")
+                return "unknown"
+        return self._version
+
+    async def synthesis(self, content: str, spkID: int, speed: float = 1):
+        logger.debug(f'Creating audio: {content}')
+        logger.debug(f'Using speaker ID: {spkID}')
+        logger.debug(f'Using speed: {speed}')
+
+        # 同じ内容の音声はキャッシュから返す
+        key = None
+        if self.cache:
+            key = make_key(content, spkID, speed, await self.version())
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached:
+                logger.debug(f"Audio cache hit: {cached}")
+                if self.in_memory:
+                    voice_byte = await asyncio.to_thread(_read_file, cached)
+                    pcm = await asyncio.to_thread(audio.to_discord_pcm, voice_byte)
+                    return SynthData(cached, audio.wav_length(voice_byte), 1, temporary=False, pcm=pcm)
+                length = await asyncio.to_thread(_wav_length, cached)
+                return SynthData(cached, length, 1, temporary=False)
+
+        try:
+            async with self._semaphore:
+                query = await self.cached_audio_query(content, spkID)
+                query["speedScale"] = speed
+                voice_byte = await self.synthesize(query, spkID)
+        except VoiceVoxError as e:
+            logger.error(f"音声合成エラー: {e}")
+            return None
+
+        length = audio.wav_length(voice_byte)
+
+        if self.cache:
+            file_dir = await asyncio.to_thread(self.cache.put, key, voice_byte)
+        elif self.in_memory:
+            # ディスクを使わない
+            file_dir = None
+        else:
+            # ランダムなIDを生成する
+            random_id = make_id(12)
+            file_dir = os.path.join(VC_OUTPUT, f"{random_id}.wav")
+
+            await asyncio.to_thread(_write_file, file_dir, voice_byte)
+
+        pcm = await asyncio.to_thread(audio.to_discord_pcm, voice_byte) if self.in_memory else None
+
+        tts_list = SynthData(file_dir, length, 1, temporary=file_dir is not None and not self.cache, pcm=pcm) # volumeは1
+
+        return tts_list
+
+    def stats(self) -> dict:
+        return {
+            "audio_cache": self.cache.stats() if self.cache else None,
+            "query_cache": self.query_cache.stats() if self.query_cache else None,
+            "engines": self.pool.stats(),
+        }
+
+    async def close(self):
+        self.pool.stop()
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+def _write_file(file_dir: str, data: bytes):
+    with open(file_dir, "wb") as f:
+        f.write(data)
+
+def _read_file(file_dir: str) -> bytes:
+    with open(file_dir, "rb") as f:
+        return f.read()
+
+def _wav_length(file) -> float:
+    """WAVの長さ（秒）"""
+    with wave.open(file, 'rb') as f:
         # 情報取得
         framerate = f.getframerate()
         frames = f.getnframes()
-        length = frames / framerate
+        return frames / framerate
+
 
-    tts_list = SynthData(file_dir, length, 1) # volumeは1
+# 共有のクライアント（TTS_CACHE_BYTES=0 / TTS_QUERY_CACHE=0でキャッシュ無効）
+client = VoiceVoxClient(
+    cache=AudioCache(VC_OUTPUT) if TTS_CACHE_BYTES > 0 else None,
+    query_cache=QueryCache() if TTS_QUERY_CACHE > 0 else None
+)
 
-    return tts_list
+async def synthesis(content: str, spkID: int, speed: float = 1):
+    return await client.synthesis(content, spkID, speed)
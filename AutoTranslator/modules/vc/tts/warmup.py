@@ -0,0 +1,137 @@
+import asyncio
+import time
+import os
+
+from modules.log import get_logger
+from modules.vc.tts import voicevox
+from modules.vc.tts.voicevox import VoiceVoxClient, VoiceVoxError
+
+# loggerの設定
+logger = get_logger(__name__)
+
+# 起動時にモデルを読み込んでおくか（未設定ならVC_ENGINESでエンジンを指定したときだけ）
+TTS_WARMUP = os.getenv("TTS_WARMUP", "1" if os.getenv("VC_ENGINES") else "0") == "1"
+# 読み込んでおく話者の数（よく使われている順）
+TTS_WARMUP_SPEAKERS = int(os.getenv("TTS_WARMUP_SPEAKERS", 5))
+# DBが無いときや設定が無いときに使う話者（tts_settings.speakerのデフォルト）
+DEFAULT_SPEAKER = 3
+# initialize_speakerが無いエンジンで代わりに合成するテキスト
+WARMUP_TEXT = "あ"
+
+
+class WarmupProgress:
+    """ウォームアップの進み具合"""
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.started > 0 and not self.finished
+
+    def stats(self) -> dict:
+        end = self.finished or time.monotonic()
+        return {
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "running": self.running,
+            "elapsed": end - self.started if self.started else 0.0,
+        }
+
+
+def load_speaker_usage(db) -> list[int]:
+    """tts_settings.speaker と user_settings.tts_speaker から使われている話者を多い順に返す"""
+    counts: dict[int, int] = {}
+    for table, column in (("tts_settings", "speaker"), ("user_settings", "tts_speaker")):
+        if not db.table_exists(table):
+            continue
+        rows = db.execute_query(
+            f"SELECT {column}, COUNT(*) FROM {table} WHERE {column} IS NOT NULL GROUP BY {column}",
+            fetch=True
+        )
+        for speaker, count in rows or []:
+            counts[int(speaker)] = counts.get(int(speaker), 0) + int(count)
+    return sorted(counts, key=lambda speaker: counts[speaker], reverse=True)
+
+
+def _open_db():
+    # DBモジュールはmariadbが必要なので使うときに読み込む
+    from modules.database.general import GeneralManager
+    return GeneralManager(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 3306)),
+        database=os.getenv("DB_NAME", "autotranslator")
+    )
+
+
+async def configured_speakers(limit: int = TTS_WARMUP_SPEAKERS) -> list[int]:
+    """ウォームアップする話者（DBが使えなければデフォルトの話者だけ）"""
+    speakers = []
+    if os.getenv("DB_HOST"):
+        db = None
+        try:
+            db = await asyncio.to_thread(_open_db)
+            speakers = await asyncio.to_thread(load_speaker_usage, db)
+        except Exception as e:
+            logger.error(f"ウォームアップする話者をDBから取得できませんでした: {e}")
+        finally:
+            if db:
+                await asyncio.to_thread(db.close)
+    if DEFAULT_SPEAKER not in speakers:
+        speakers.append(DEFAULT_SPEAKER)
+    return speakers[:max(1, limit)]
+
+
+async def warm_up(client: VoiceVoxClient, speakers: list[int], progress: WarmupProgress = None) -> WarmupProgress:
+    """話者のモデルを順番に読み込む"""
+    progress = progress or WarmupProgress()
+    progress.total = len(speakers)
+    progress.started = time.monotonic()
+    logger.info(f"VOICEVOXのウォームアップを開始します: {len(speakers)}人")
+
+    for spkID in speakers:
+        start = time.perf_counter()
+        try:
+            try:
+                await client.initialize_speaker(spkID)
+            except VoiceVoxError as e:
+                if e.status != 404:
+                    raise
+                # 古いエンジンは小さな合成で読み込ませる
+                query = await client.cached_audio_query(WARMUP_TEXT, spkID)
+                await client.synthesize(query, spkID)
+            progress.done += 1
+            logger.info(f"ウォームアップ ({progress.done + progress.failed}/{progress.total}): 話者 {spkID} {time.perf_counter() - start:.2f}s")
+        except VoiceVoxError as e:
+            progress.failed += 1
+            logger.warning(f"ウォームアップ ({progress.done + progress.failed}/{progress.total}): 話者 {spkID} の読み込みに失敗しました: {e}")
+
+    progress.finished = time.monotonic()
+    logger.info(f"VOICEVOXのウォームアップ完了 (成功: {progress.done}、 失敗: {progress.failed}、 {progress.finished - progress.started:.1f}s)")
+    return progress
+
+
+# 共有の進み具合
+progress = WarmupProgress()
+_task: asyncio.Task = None
+
+def start_warmup() -> asyncio.Task:
+    """バックグラウンドでウォームアップを始める（実行中・完了済みなら何もしない）"""
+    global _task
+    if not TTS_WARMUP or _task is not None:
+        return _task
+
+    async def run():
+        try:
+            await warm_up(voicevox.client, await configured_speakers(), progress)
+        except Exception:
+            logger.exception("VOICEVOXのウォームアップに失敗しました")
+
+    _task = asyncio.create_task(run())
+    return _task
@@ -0,0 +1,21 @@
+import sys
+import os
+
+import pytest
+
+# AutoTranslatorディレクトリから実行したときと同じように読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 音声のキャッシュは使わない（読み込む前に設定する）
+os.environ.setdefault("TTS_CACHE_BYTES", "0")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir(tmp_path_factory):
+    """voicevoxは読み込み時に ./tts_cache を作るので一時ディレクトリで実行する"""
+    cwd = os.getcwd()
+    path = tmp_path_factory.mktemp("work")
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
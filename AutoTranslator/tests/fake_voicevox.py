@@ -0,0 +1,85 @@
+import asyncio
+import wave
+import io
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+FS = 24000
+
+
+def make_wav(seconds: float = 0.1) -> bytes:
+    """無音のWAV（VOICEVOXと同じ24kHz・モノラル・16bit）"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(FS)
+        f.writeframes(b"\0\0" * int(FS * seconds))
+    return buffer.getvalue()
+
+
+class FakeVoiceVox:
+    """テスト用のVOICEVOXエンジン（/audio_query・/synthesis・/version だけ）
+
+    fail に回数を入れるとその回数だけ status（5xx）を返す。-1なら返し続ける。
+    """
+
+    def __init__(self, delay: float = 0.0, seconds: float = 0.1):
+        self.delay = delay
+        self.wav = make_wav(seconds)
+        self.fail = 0
+        self.status = 503
+        # 受け取ったリクエスト (パス, 話者ID)
+        self.requests: list[tuple[str, int]] = []
+        self.outstanding = 0
+        self.peak_outstanding = 0
+        self._server: TestServer = None
+
+    @property
+    def url(self) -> str:
+        return str(self._server.make_url("")).rstrip("/")
+
+    async def start(self) -> "FakeVoiceVox":
+        app = web.Application()
+        app.router.add_post("/audio_query", self._audio_query)
+        app.router.add_post("/synthesis", self._synthesis)
+        app.router.add_get("/version", self._version)
+        self._server = TestServer(app)
+        await self._server.start_server()
+        return self
+
+    async def close(self):
+        if self._server:
+            await self._server.close()
+
+    def count(self, path: str) -> int:
+        return sum(1 for p, _ in self.requests if p == path)
+
+    async def _handle(self, request: web.Request, response):
+        self.requests.append((request.path, int(request.query.get("speaker", -1))))
+        if self.fail:
+            if self.fail > 0:
+                self.fail -= 1
+            return web.Response(status=self.status, text="fake error")
+
+        self.outstanding += 1
+        self.peak_outstanding = max(self.peak_outstanding, self.outstanding)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return response()
+        finally:
+            self.outstanding -= 1
+
+    async def _audio_query(self, request: web.Request):
+        text = request.query["text"]
+        return await self._handle(request, lambda: web.json_response({"text": text, "speedScale": 1.0}))
+
+    async def _synthesis(self, request: web.Request):
+        return await self._handle(request, lambda: web.Response(body=self.wav, content_type="audio/wav"))
+
+    async def _version(self, request: web.Request):
+        if self.fail:
+            return web.Response(status=self.status)
+        return web.json_response("0.0.0-fake")
@@ -0,0 +1,36 @@
+import pytest
+
+from modules.detect import detect_script, detect_language
+
+
+@pytest.mark.parametrize("text, lang", [
+    ("こんにちは", "ja"),
+    ("VCに入るね", "ja"),
+    ("안녕하세요", "ko"),
+    ("can you hear me?", "en"),
+    ("I'll be there in 5 min", "en"),
+])
+def test_detect_script(text, lang):
+    assert detect_script(text) == lang
+
+
+@pytest.mark.parametrize("text", ["gg", "lol", "ok", "brb", "GG WP", "thanks!"])
+def test_short_ascii_falls_through(text):
+    # 短い英字だけの文は英語と決めつけずにプロファイルで判定する
+    assert detect_script(text) is None
+
+
+@pytest.mark.parametrize("text, lang", [
+    ("thanks!", "en"),
+    # プロファイルが日本語・英語以外を返す短い英字の文は判定しない
+    ("gg", None),
+    ("lol", None),
+    ("GG WP", None),
+    # 漢字だけの文は日本語
+    ("了解", "ja"),
+    ("草", "ja"),
+    # 文字種で判定できない長い文はこれまで通りプロファイルで判定する
+    ("Bonjour à tous", "fr"),
+])
+def test_detect_language(text, lang):
+    assert detect_language(text) == lang
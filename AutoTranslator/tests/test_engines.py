@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_voicevox import FakeVoiceVox
+from modules.vc.tts import engines
+from modules.vc.tts.engines import EnginePool
+
+
+@pytest.fixture
+def voicevox(monkeypatch):
+    from modules.vc.tts import voicevox
+    monkeypatch.setattr(voicevox.random, "random", lambda: 0.0)
+    return voicevox
+
+
+def test_pick_least_outstanding():
+    pool = EnginePool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.engines
+    a.outstanding, b.outstanding, c.outstanding = 3, 1, 2
+    assert pool.pick() is b
+    # 除外したエンジン以外から選ぶ
+    assert pool.pick(exclude=b) is c
+
+
+def test_pick_keeps_speaker_on_same_engine(monkeypatch):
+    monkeypatch.setattr(engines, "VC_STICKY_SLACK", 2)
+    pool = EnginePool(["http://a", "http://b"])
+    a, b = pool.engines
+
+    assert pool.pick(1) is a
+    # 少し混んでいても同じ話者は同じエンジンを使う
+    a.outstanding = 2
+    assert pool.pick(1) is a
+    # 別の話者は空いている方へ
+    assert pool.pick(2) is b
+    # 混みすぎたら移る
+    a.outstanding = 3
+    assert pool.pick(1) is b
+    a.outstanding = 0
+    assert pool.pick(1) is b
+
+
+def test_requests_spread_over_engines(voicevox):
+    async def main():
+        fakes = [await FakeVoiceVox(delay=0.1).start() for _ in range(2)]
+        client = voicevox.VoiceVoxClient(pool=EnginePool([f.url for f in fakes]), concurrency=4)
+        try:
+            results = await asyncio.gather(*(client.synthesis(f"テキスト{i}", i) for i in range(8)))
+            # 同じ話者をもう一度読むと同じエンジンへ行く
+            sticky = {spkID: client.pool.pick(spkID).base_url for spkID in range(8)}
+            for f in fakes:
+                f.requests.clear()
+            await asyncio.gather(*(client.synthesis(f"もう一度{i}", i) for i in range(8)))
+            return fakes, [f.url for f in fakes], results, sticky
+        finally:
+            await client.close()
+            for f in fakes:
+                await f.close()
+
+    fakes, urls, results, sticky = asyncio.run(main())
+    assert all(results)
+    # 処理中の少ない方へ振り分けるので同時に処理する数は偏らない
+    assert [f.peak_outstanding for f in fakes] == [4, 4]
+    for f, url in zip(fakes, urls):
+        for _, spkID in f.requests:
+            assert sticky[spkID] == url
+
+
+def test_breaker_opens_and_recovers(voicevox, monkeypatch):
+    monkeypatch.setattr(engines, "VC_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(engines, "VC_BREAKER_COOLDOWN", 0.5)
+    monkeypatch.setattr(engines, "VC_HEALTH_INTERVAL", 60)
+
+    async def main():
+        broken, healthy = [await FakeVoiceVox().start() for _ in range(2)]
+        client = voicevox.VoiceVoxClient(pool=EnginePool([broken.url, healthy.url]), retries=3)
+        engine = client.pool.engines[0]
+        try:
+            broken.fail = -1
+            # 失敗したら別のエンジンでやり直すので合成はできる
+            # （話者ごとに振り分け直されるので毎回別の話者を使う）
+            for i in range(3):
+                assert await client.synthesis(f"切り離し{i}", 10 + i)
+            assert engine.trips == 1
+            assert not engine.available(time.monotonic())
+            failed = broken.count("/audio_query")
+
+            # 切り離している間は送らない
+            assert await client.synthesis("切り離し中", 20)
+            assert broken.count("/audio_query") == failed
+
+            # 時間が経てば戻る
+            broken.fail = 0
+            await asyncio.sleep(0.6)
+            broken.requests.clear()
+            assert await client.synthesis("復帰", 30)
+            return broken, engine
+        finally:
+            await client.close()
+            await broken.close()
+            await healthy.close()
+
+    broken, engine = asyncio.run(main())
+    assert broken.count("/synthesis") == 1
+    assert engine.failures == 0
+    assert engine.trips == 1
+
+
+def test_probe_restores_engine(voicevox, monkeypatch):
+    monkeypatch.setattr(engines, "VC_BREAKER_FAILURES", 1)
+    monkeypatch.setattr(engines, "VC_BREAKER_COOLDOWN", 60)
+    monkeypatch.setattr(engines, "VC_HEALTH_INTERVAL", 0.1)
+
+    async def main():
+        fakes = [await FakeVoiceVox().start() for _ in range(2)]
+        client = voicevox.VoiceVoxClient(pool=EnginePool([f.url for f in fakes]))
+        engine = client.pool.engines[0]
+        try:
+            fakes[0].fail = -1
+            assert await client.synthesis("切り離し", 1)
+            assert not engine.available(time.monotonic())
+
+            # 死活確認が応答を確認すればクールダウンを待たずに戻る
+            fakes[0].fail = 0
+            await asyncio.sleep(0.3)
+            return engine.available(time.monotonic())
+        finally:
+            await client.close()
+            for f in fakes:
+                await f.close()
+
+    assert asyncio.run(main())
@@ -0,0 +1,65 @@
+from modules.database.settings_cache import SettingsCache
+
+KEY = ("db", "tts_settings", 1)
+
+
+def make_cache(max_rows: int = 100) -> SettingsCache:
+    cache = SettingsCache(max_rows)
+    cache.register("tts_settings", [("id", "BIGINT"), ("speaker", "INT"), ("speed", "FLOAT")])
+    return cache
+
+
+def test_put_and_update():
+    cache = make_cache()
+    cache.put(*KEY, {"id": 1, "speaker": "3", "speed": 1})
+    cache.update(*KEY, {"speed": "1.5"})
+    assert cache.get(*KEY) == {"id": 1, "speaker": 3, "speed": 1.5}
+
+
+def test_load_started_before_save_is_not_cached():
+    cache = make_cache()
+    # 読み込みを始めた後に（キャッシュに無い行へ）保存された
+    generation = cache.begin_load()
+    cache.update(*KEY, {"speaker": 8})
+    row = cache.put(*KEY, {"id": 1, "speaker": 3, "speed": 1.0}, generation)
+
+    # 読んだ行は返すが古いので覚えない
+    assert row["speaker"] == 3
+    assert cache.get(*KEY) is None
+
+    # 保存の後に始めた読み込みは覚える
+    generation = cache.begin_load()
+    cache.put(*KEY, {"id": 1, "speaker": 8, "speed": 1.0}, generation)
+    assert cache.get(*KEY)["speaker"] == 8
+
+
+def test_invalidate_during_load():
+    cache = make_cache()
+    generation = cache.begin_load()
+    cache.invalidate(*KEY)
+    cache.put(*KEY, {"id": 1, "speaker": 3, "speed": 1.0}, generation)
+    assert cache.get(*KEY) is None
+
+    # テーブルごと無効化したときはすべての読み込みを覚えない
+    generation = cache.begin_load()
+    cache.invalidate("db", "tts_settings")
+    cache.put("db", "tts_settings", 2, {"id": 2, "speaker": 3, "speed": 1.0}, generation)
+    assert cache.get("db", "tts_settings", 2) is None
+
+
+def test_other_rows_are_cached_during_save():
+    cache = make_cache()
+    generation = cache.begin_load()
+    cache.update(*KEY, {"speaker": 8})
+    cache.put("db", "tts_settings", 2, {"id": 2, "speaker": 3, "speed": 1.0}, generation)
+    assert cache.get("db", "tts_settings", 2) is not None
+
+
+def test_forgotten_writes_are_treated_as_stale():
+    cache = make_cache(max_rows=2)
+    generation = cache.begin_load()
+    for primary_id in range(1, 5):
+        cache.update("db", "tts_settings", primary_id, {"speaker": 8})
+    # 記録から消えた書き込みがあっても古い行は覚えない
+    cache.put(*KEY, {"id": 1, "speaker": 3, "speed": 1.0}, generation)
+    assert cache.get(*KEY) is None
@@ -0,0 +1,114 @@
+import asyncio
+import time
+import os
+
+import pytest
+
+from fake_voicevox import FakeVoiceVox
+
+
+@pytest.fixture
+def voicevox(monkeypatch):
+    from modules.vc.tts import voicevox
+    # バックオフの揺らぎを無くす（0.2秒、0.4秒…）
+    monkeypatch.setattr(voicevox.random, "random", lambda: 0.0)
+    return voicevox
+
+
+def make_client(voicevox, engines, **kwargs):
+    from modules.vc.tts.engines import EnginePool
+    return voicevox.VoiceVoxClient(pool=EnginePool([e.url for e in engines]), **kwargs)
+
+
+def test_synthesis_returns_pcm(voicevox):
+    async def main():
+        engine = await FakeVoiceVox(seconds=0.5).start()
+        client = make_client(voicevox, [engine], in_memory=True)
+        try:
+            data = await client.synthesis("こんにちは", 3, speed=1.2)
+        finally:
+            await client.close()
+            await engine.close()
+        return engine, data
+
+    engine, data = asyncio.run(main())
+    assert isinstance(data, voicevox.SynthData)
+    assert data.length == pytest.approx(0.5)
+    assert data.directory is None
+    assert not data.temporary
+    # 24kHzモノラル -> 48kHzステレオ16bit
+    assert len(data.pcm) == int(0.5 * 48000) * 4
+    assert engine.requests == [("/audio_query", 3), ("/synthesis", 3)]
+
+
+def test_synthesis_writes_temporary_file(voicevox):
+    async def main():
+        engine = await FakeVoiceVox().start()
+        client = make_client(voicevox, [engine], in_memory=False)
+        try:
+            return await client.synthesis("ファイル", 1)
+        finally:
+            await client.close()
+            await engine.close()
+
+    data = asyncio.run(main())
+    assert data.temporary
+    assert data.pcm is None
+    assert os.path.exists(data.directory)
+
+
+def test_retries_server_errors_with_backoff(voicevox):
+    async def main():
+        engine = await FakeVoiceVox().start()
+        engine.fail = 2
+        client = make_client(voicevox, [engine], retries=3)
+        try:
+            start = time.monotonic()
+            data = await client.synthesis("再試行", 1)
+            return engine, data, time.monotonic() - start
+        finally:
+            await client.close()
+            await engine.close()
+
+    engine, data, elapsed = asyncio.run(main())
+    assert data is not None
+    # 2回失敗して3回目で成功する
+    assert engine.count("/audio_query") == 3
+    assert engine.count("/synthesis") == 1
+    assert elapsed >= 0.2 + 0.4
+
+
+def test_gives_up_after_retries(voicevox):
+    async def main():
+        engine = await FakeVoiceVox().start()
+        engine.fail = -1
+        engine.status = 500
+        client = make_client(voicevox, [engine], retries=2)
+        try:
+            return engine, await client.synthesis("失敗", 1)
+        finally:
+            await client.close()
+            await engine.close()
+
+    engine, data = asyncio.run(main())
+    assert data is None
+    assert engine.count("/audio_query") == 2
+
+
+def test_client_errors_are_not_retried(voicevox):
+    async def main():
+        engine = await FakeVoiceVox().start()
+        engine.fail = 1
+        engine.status = 422
+        client = make_client(voicevox, [engine], retries=3)
+        try:
+            with pytest.raises(voicevox.VoiceVoxError) as e:
+                await client.audio_query("不正", 1)
+            return engine, e.value
+        finally:
+            await client.close()
+            await engine.close()
+
+    engine, error = asyncio.run(main())
+    assert error.status == 422
+    assert engine.count("/audio_query") == 1